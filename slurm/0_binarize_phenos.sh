@@ -29,9 +29,18 @@ unset __conda_setup
 conda activate ukbiobank
 
 echo `date` starting job on $HOSTNAME
-LINE=$(sed -n "$SLURM_ARRAY_TASK_ID"p /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/slurm/files/binarize_pheno_types.txt)
+# every type line can be split into N_SHARDS array tasks across nodes, for e.g. 4 shards per type:
+# sbatch --array 1-16 --export=ALL,N_SHARDS=4 0_binarize_phenos.sh
+N_SHARDS=${N_SHARDS:-1}
+LINE_ID=$(( (SLURM_ARRAY_TASK_ID - 1) / N_SHARDS + 1 ))
+SHARD_ID=$(( (SLURM_ARRAY_TASK_ID - 1) % N_SHARDS + 1 ))
+LINE=$(sed -n "$LINE_ID"p /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/slurm/files/binarize_pheno_types.txt)
+SHARD_ARGS=""
+if [ "$N_SHARDS" -gt 1 ]; then
+    SHARD_ARGS="--shard $SHARD_ID/$N_SHARDS"
+fi
 
-echo $LINE
-python /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/src/0_binarize_phenos.py $LINE 
+echo $LINE $SHARD_ARGS
+python /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/src/0_binarize_phenos.py $LINE $SHARD_ARGS
 
 echo `date` ending job
@@ -0,0 +1,40 @@
+#!/bin/bash
+#SBATCH --account=girirajan
+#SBATCH --partition=girirajan
+#SBATCH --job-name=pheno_meta_merge
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=1
+#SBATCH --time=400:0:0
+#SBATCH --mem-per-cpu=4G
+#SBATCH --chdir /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/src
+#SBATCH -o /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/slurm/logs/out_meta_merge.log
+#SBATCH -e /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/slurm/logs/err_meta_merge.log
+
+
+# >>> conda initialize >>>
+# !! Contents within this block are managed by 'conda init' !!
+__conda_setup="$('/data5/deepro/miniconda3/bin/conda' 'shell.bash' 'hook' 2> /dev/null)"
+if [ $? -eq 0 ]; then
+    eval "$__conda_setup"
+else
+    if [ -f "/data5/deepro/miniconda3/etc/profile.d/conda.sh" ]; then
+        . "/data5/deepro/miniconda3/etc/profile.d/conda.sh"
+    else
+        export PATH="/data5/deepro/miniconda3/bin:$PATH"
+    fi
+fi
+unset __conda_setup
+# <<< conda initialize <<<
+
+conda activate ukbiobank
+
+echo `date` starting job on $HOSTNAME
+
+pheno_store="/data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/data"
+# the number of array tasks of 1_prepare_meta_sharded.sh, submit after it completes:
+# sbatch --dependency=afterok:<sharded job id> 2_merge_meta_shards.sh
+n_shards=4
+
+python /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/src/2_merge_meta_shards.py $pheno_store $n_shards
+
+echo `date` ending job
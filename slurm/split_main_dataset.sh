@@ -0,0 +1,40 @@
+#!/bin/bash
+#SBATCH --account=girirajan
+#SBATCH --partition=girirajan
+#SBATCH --job-name=split_main
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=8
+#SBATCH --time=400:0:0
+#SBATCH --mem-per-cpu=4G
+#SBATCH --chdir /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/src
+#SBATCH -o /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/slurm/logs/out_split.log
+#SBATCH -e /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/slurm/logs/err_split.log
+
+
+# >>> conda initialize >>>
+# !! Contents within this block are managed by 'conda init' !!
+__conda_setup="$('/data5/deepro/miniconda3/bin/conda' 'shell.bash' 'hook' 2> /dev/null)"
+if [ $? -eq 0 ]; then
+    eval "$__conda_setup"
+else
+    if [ -f "/data5/deepro/miniconda3/etc/profile.d/conda.sh" ]; then
+        . "/data5/deepro/miniconda3/etc/profile.d/conda.sh"
+    else
+        export PATH="/data5/deepro/miniconda3/bin:$PATH"
+    fi
+fi
+unset __conda_setup
+# <<< conda initialize <<<
+
+conda activate ukbiobank
+
+echo `date` starting job on $HOSTNAME
+
+lifestyle="/data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/data/lifestyle_v2.xlsx"
+# the UKB main dataset csv is passed as the first argument: sbatch split_main_dataset.sh <main dataset csv>
+main_dataset=$1
+pheno_info="/data5/deepro/ukbiobank/download/download_phenotypes/data"
+
+python /data5/deepro/ukbiobank/preprocess/rarecomb_pheno_prepare/src/split_main_dataset.py $lifestyle $main_dataset $pheno_info -w $SLURM_CPUS_PER_TASK
+
+echo `date` ending job
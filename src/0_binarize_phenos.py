@@ -3,28 +3,60 @@
 FILE_OBJECTIVE = """Binarize phenotypes based on their field values"""
 
 import argparse
-import multiprocessing as mp
+import os
+import time
+import functools
+import traceback
+import collections
 import utils as ut
+from concurrent.futures import ThreadPoolExecutor
 
 
-def create_binarized_table(
-    exome_df, 
+# quantiles used by the quantile binarizing strategy of integer and continuous types
+QUANTILE_LOW = 0.05
+QUANTILE_HIGH = 0.95
+
+
+def restrict_merged_table(pheno_merged_fields_df, exome_eids, restrict):
+    """
+    Restricts the merged table to the samples with exome data while keeping the merged
+    values of all samples as the reference for computing thresholds and ordinal bins
+    """
+    if not restrict:
+        return pheno_merged_fields_df, None
+    reference = pheno_merged_fields_df["merged"]
+    return ut.filter_pheno_with_exomes(pheno_merged_fields_df, exome_eids), reference
+
+
+def get_binarized_table_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, method, storage, field_plan=None):
+    if field_plan is not None:
+        return field_plan["binarized_tables"][method]
+    return ut.get_binarized_table_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, method, storage)
+
+
+def load_field_inputs(
     pheno_info_root, pheno_type, pheno_cat, pheno_id, pheno_ordinal, pheno_storage_root, 
-    strategy
+    strategies, previous_entries=None, field_plan=None, exome_eids=None, storage="csv", exome_hash="", force=False,
+    exome_only=False, threshold_samples="all", chunksize=ut.PHENO_TABLE_CHUNKSIZE, report=False, exclude_negatives=False
     ):
+    """
+    The reading stage of a field: reads its encodings, checks which of its binarized tables
+    are stale and reads its raw table only if any of them is. The paths and encodings are taken
+    from the field plan when given. It returns the field inputs needed by binarize_field_inputs
+    """
+    # opt-in per field instrumentation, a disabled report records nothing
+    field_report = ut.FieldReport(pheno_id, pheno_type, enabled=report)
     # get the pheno table path where sample to pheno info is stored
-    pheno_table_path = ut.get_pheno_table_filepath(pheno_info_root, pheno_type, pheno_cat, pheno_id)
-    pheno_all_df = ut.read_pheno_table(pheno_table_path)
-    # get rid of all negative pheno values except for categorical multiples
-    pheno_no_negative_vals_df = ut.filter_pheno_table_no_negs(pheno_all_df, pheno_type)
-    
-    if pheno_type in {"categorical_single", "categorical_multiple"}:
-        # merge pheno info values depending on the type of phenotype
-        pheno_merged_fields_df = ut.merge_values_categorical(pheno_no_negative_vals_df, pheno_type)
-        # binarize categoricals
+    if field_plan is not None:
+        pheno_table_path = field_plan["pheno_table_path"]
+    else:
+        pheno_table_path = ut.get_pheno_table_filepath(pheno_info_root, pheno_type, pheno_cat, pheno_id)
+    pheno_encodings, ohe_encodings,  ordinal_encodings = None, None, None
+    if field_plan is not None and field_plan["encodings"] is not None:
+        pheno_encodings, ohe_encodings, ordinal_encodings = field_plan["encodings"]
+    elif pheno_type in {"categorical_single", "categorical_multiple"}:
         pheno_encoding_path = ut.get_pheno_encoding_filepath(pheno_info_root, pheno_type, pheno_cat)
         pheno_encodings = ut.read_pheno_encodings(pheno_encoding_path, pheno_id)
-        ohe_encodings,  ordinal_encodings = None, None
         if pheno_ordinal == "B":
             # this type of phenos have both ordinal and ohe type encodings example: field 4537: Work/job satisfaction
             # a separately prepared modified field encodings json file is required for these
@@ -32,38 +64,276 @@ def create_binarized_table(
             ordinal_encoding_path = ut.get_modified_pheno_encoding_filepath(pheno_storage_root, "ordinal")
             ohe_encodings = ut.read_pheno_encodings(ohe_encoding_path, pheno_id)
             ordinal_encodings = ut.read_pheno_encodings(ordinal_encoding_path, pheno_id)
-        pheno_binarized_df = ut.binarize_categoricals(pheno_merged_fields_df, pheno_type, pheno_encodings, pheno_ordinal, ohe_encodings, ordinal_encodings)
-    elif pheno_type in {"integer", "continuous"}:
+
+    # one binarized table is saved per strategy, each one skipped if none of its inputs 
+    # changed since it was saved
+    previous_entries = [ut.get_run_manifest_entry(e) for e in previous_entries] if previous_entries is not None else [{}] * len(strategies)
+    # the raw table is only hashed again when its size or mtime changed since the last run
+    pheno_table_stat = os.stat(pheno_table_path)
+    pheno_table_stat = [pheno_table_stat.st_size, pheno_table_stat.st_mtime_ns]
+    pheno_table_hash = next((e["table_hash"] for e in previous_entries if e.get("table_stat") == pheno_table_stat), None)
+    if pheno_table_hash is None:
+        pheno_table_hash = ut.hash_file(pheno_table_path)
+    binarized_tables, stale_strategies = [], []
+    for strategy, previous_entry in zip(strategies, previous_entries):
+        binarize_strategy = ut.parse_binarize_strategy(strategy, QUANTILE_LOW, QUANTILE_HIGH)
+        binarized_table_path = get_binarized_table_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, binarize_strategy[0], storage, field_plan)
+        field_hash = ut.hash_field_inputs(
+            table=pheno_table_hash,
+            encodings=[pheno_encodings, ohe_encodings, ordinal_encodings],
+            ordinal=pheno_ordinal,
+            strategy=strategy,
+            quantiles=[QUANTILE_LOW, QUANTILE_HIGH],
+            exomes=exome_hash,
+            storage=storage,
+            # the options below are only hashed when set so that the tables of earlier runs stay up to date
+            **({"samples": [exome_only, threshold_samples]} if exome_only else {}),
+            **({"exclude_negatives": True} if exclude_negatives and pheno_type in {"integer", "continuous"} else {})
+            )
+        binarized_tables.append((binarized_table_path, {"hash": field_hash, "table_hash": pheno_table_hash, "table_stat": pheno_table_stat}))
+        if force or field_hash != previous_entry.get("hash") or not os.path.exists(binarized_table_path):
+            stale_strategies.append(binarize_strategy)
+    field_report.lap("check_inputs")
+    field_inputs = {
+        "pheno_type": pheno_type, "pheno_cat": pheno_cat, "pheno_id": pheno_id, "pheno_ordinal": pheno_ordinal,
+        "pheno_storage_root": pheno_storage_root, "storage": storage, "exome_eids": exome_eids,
+        "encodings": (pheno_encodings, ohe_encodings, ordinal_encodings),
+        "binarized_tables": binarized_tables, "stale_strategies": stale_strategies, 
+        "restrict": False, "pheno_all_df": None, "field_report": field_report, "exclude_negatives": exclude_negatives,
+        }
+    if not stale_strategies:
+        field_report.skipped = True
+        return field_inputs
+
+    # in exome only mode, restrict to the samples with exome data while reading the raw table;
+    # fields whose thresholds or ordinal bins are computed on all samples are restricted after merging
+    needs_all_samples = threshold_samples == "all" and (
+        pheno_type in {"integer", "continuous"} or (pheno_type == "categorical_single" and pheno_ordinal != "O")
+        )
+    read_eids = None
+    if exome_only and not needs_all_samples:
+        read_eids = exome_eids if exome_eids is not None else ut.get_shared_exome_eids()
+    field_inputs["restrict"] = exome_only and needs_all_samples
+    # the raw table is parsed in chunks of rows with compact dtypes
+    field_inputs["pheno_all_df"] = ut.read_pheno_table(pheno_table_path, chunksize, read_eids)
+    field_report.lap("read", field_inputs["pheno_all_df"])
+    return field_inputs
+
+
+def save_binarized_table(field_report, *save_args):
+    """
+    The writing stage of a field: saves one of its binarized tables, timed on its own 
+    so that it can run in a writer thread
+    """
+    save_start = time.perf_counter()
+    ut.save_pheno_table(*save_args)
+    if field_report.enabled:
+        field_report.stage_times["save"] = field_report.stage_times.get("save", 0) + time.perf_counter() - save_start
+    return
+
+
+def binarize_field_inputs(field_inputs, save=save_binarized_table):
+    """
+    The computing stage of a field: filters, merges and binarizes its raw table and
+    hands each binarized table to the save function
+    """
+    pheno_type, pheno_id, exome_eids = field_inputs["pheno_type"], field_inputs["pheno_id"], field_inputs["exome_eids"]
+    pheno_encodings, ohe_encodings, ordinal_encodings = field_inputs["encodings"]
+    stale_strategies, field_report = field_inputs["stale_strategies"], field_inputs["field_report"]
+    if not stale_strategies:
+        return
+    # the raw table is released by the field inputs as soon as it is used
+    pheno_all_df = field_inputs.pop("pheno_all_df")
+    field_report.last_lap = time.perf_counter()
+    
+    if pheno_type in {"categorical_single", "categorical_multiple"}:
+        # get rid of all negative pheno values except for categorical multiples
+        pheno_no_negative_vals_df = ut.filter_pheno_table_no_negs(pheno_all_df, pheno_type)
+        field_report.lap("filter_negatives", pheno_no_negative_vals_df)
         # merge pheno info values depending on the type of phenotype
-        pheno_merged_fields_df = ut.merge_values_numerical(pheno_no_negative_vals_df)
-        # binarize numerical pheno values based on the strategy selected 
-        pheno_binarized_df = ut.binarize_numericals(pheno_merged_fields_df, strategy=strategy, quantile_low=0.05, quantile_high=0.95)
-    # keep pheno values only for the samples with exome data
-    pheno_binarized_df = ut.filter_pheno_with_exomes(pheno_binarized_df, exome_df)
-    # save the binarized table of the field in root -> type -> category dir 
-    ut.save_pheno_table(pheno_binarized_df, pheno_storage_root, pheno_type, pheno_cat, pheno_id, strategy)
+        pheno_merged_fields_df = ut.merge_values_categorical(pheno_no_negative_vals_df, pheno_type)
+        field_report.lap("merge", pheno_merged_fields_df)
+        pheno_merged_fields_df, reference = restrict_merged_table(pheno_merged_fields_df, exome_eids, field_inputs["restrict"])
+        # binarize categoricals, the strategies only name their tables
+        pheno_binarized_df = ut.binarize_categoricals(pheno_merged_fields_df, pheno_type, pheno_encodings, field_inputs["pheno_ordinal"], ohe_encodings, ordinal_encodings, reference)
+        pheno_binarized_dfs = {method: pheno_binarized_df for method, *_ in stale_strategies}
+    elif pheno_type in {"integer", "continuous"}:
+        # get rid of all negative pheno values and merge the rest into their mean in one pass, 
+        # the merge is timed as part of the filtering stage
+        pheno_merged_fields_df = ut.filter_merge_values_numerical(pheno_all_df, pheno_type, field_inputs["exclude_negatives"])
+        field_report.lap("filter_negatives", pheno_merged_fields_df)
+        pheno_merged_fields_df, reference = restrict_merged_table(pheno_merged_fields_df, exome_eids, field_inputs["restrict"])
+        # binarize numerical pheno values for all the selected strategies from one sorted copy of the merged values
+        pheno_binarized_dfs = ut.binarize_numericals_multi(pheno_merged_fields_df, stale_strategies, reference=reference)
+    field_report.lap("binarize")
+    for method, pheno_binarized_df in pheno_binarized_dfs.items():
+        # keep pheno values only for the samples with exome data
+        # exome sample ids are shared once per worker by the pool initializer
+        pheno_binarized_df = ut.filter_pheno_with_exomes(pheno_binarized_df, exome_eids)
+        field_report.lap("exome_filter", pheno_binarized_df)
+        # prevalences are named after the strategy only when several strategies are binarized
+        field_report.count_indicators(pheno_binarized_df, ut.get_binarized_columns(pheno_binarized_df.columns), method if len(pheno_binarized_dfs) > 1 else "")
+        # save the binarized table of the field in root -> type -> category dir 
+        save(field_report, pheno_binarized_df, field_inputs["pheno_storage_root"], pheno_type, field_inputs["pheno_cat"], pheno_id, method, field_inputs["storage"])
+        field_report.last_lap = time.perf_counter()
     return
 
+
+def create_binarized_table(*field_args, **field_options):
+    """
+    Reads, binarizes and saves the binarized tables of a field one stage after the other
+    """
+    field_inputs = load_field_inputs(*field_args, **field_options)
+    binarize_field_inputs(field_inputs)
+    return field_inputs["binarized_tables"], field_inputs["field_report"].to_dict()
+
+
+def create_binarized_table_batch(batch, prefetch=2, **field_options):
+    """
+    Binarizes a batch of (position, field args) in a pipeline of three stages: a reader thread
+    loads the inputs of up to prefetch upcoming fields, the worker binarizes the current field and
+    a writer thread saves the binarized tables. At most prefetch fields wait to be written, so
+    the memory held by the pipeline is bounded. Returns (position, result, error) of every field
+    """
+    batch_results = []
+    def finish_field(position, field_inputs, pending_saves):
+        try:
+            for pending_save in pending_saves:
+                pending_save.result()
+            batch_results.append((position, (field_inputs["binarized_tables"], field_inputs["field_report"].to_dict()), None))
+        except Exception:
+            batch_results.append((position, None, traceback.format_exc()))
+
+    batch_iter = iter(batch)
+    with ThreadPoolExecutor(1) as reader, ThreadPoolExecutor(1) as writer:
+        def prefetch_next(pending_loads):
+            for position, field_args in batch_iter:
+                pending_loads.append((position, reader.submit(load_field_inputs, *field_args, **field_options)))
+                break
+        pending_loads, pending_writes = collections.deque(), collections.deque()
+        for _ in range(max(prefetch, 1)):
+            prefetch_next(pending_loads)
+        while pending_loads:
+            position, pending_load = pending_loads.popleft()
+            prefetch_next(pending_loads)
+            try:
+                field_inputs = pending_load.result()
+                pending_saves = []
+                binarize_field_inputs(field_inputs, lambda *save_args: pending_saves.append(writer.submit(save_binarized_table, *save_args)))
+            except Exception:
+                batch_results.append((position, None, traceback.format_exc()))
+                continue
+            pending_writes.append((position, field_inputs, pending_saves))
+            while len(pending_writes) > max(prefetch, 1):
+                finish_field(*pending_writes.popleft())
+        while pending_writes:
+            finish_field(*pending_writes.popleft())
+    return batch_results
+
+def get_batch_field_results(batch_results, batches):
+    """
+    Yields (position, result, error) of every field from the results of the batches,
+    all the fields of a batch that failed as a whole get the error of the batch
+    """
+    for batch_idx, field_results, error in batch_results:
+        if error is not None:
+            field_results = [(position, None, error) for position in batches[batch_idx]]
+        yield from field_results
+
+
 def main(
     phenos_of_interest_file, exome_file, pheno_info_root, pheno_storage_root,
-    pheno_type, strategy, threads
+    pheno_type, strategies, threads, storage, force, exome_only, threshold_samples, chunksize, report, report_top_n, prefetch, shard, exclude_negatives
     ):
     
-    # read phenos of interest df
-    phenos_of_interest_df = ut.read_phenos_of_interest_data(phenos_of_interest_file)
-    # read exome df
-    exome_df = ut.read_exome_data(exome_file)
-    # from the phenos of interest, select the ones that fall under an user defined type
-    phenos_of_interest_df = phenos_of_interest_df.loc[phenos_of_interest_df.Type.isin([pheno_type])]
+    methods = [ut.get_binarize_method(strategy) for strategy in strategies]
+    if ut.is_field_plan(phenos_of_interest_file):
+        # the fields of the user defined type with their paths, encodings and costs compiled by compile_field_plan.py
+        field_plan = ut.read_field_plan(phenos_of_interest_file, pheno_info_root, pheno_storage_root, storage)
+        fields = ut.get_plan_fields(field_plan, pheno_type)
+        for _, _, i, _, f in fields:
+            if not set(methods) <= set(f["binarized_tables"]):
+                raise ValueError(f"The field plan has no binarized tables of the strategies {strategies} for field {i}, compile it with them")
+    else:
+        # read phenos of interest df
+        phenos_of_interest_df = ut.read_phenos_of_interest_data(phenos_of_interest_file)
+        # from the phenos of interest, select the ones that fall under an user defined type
+        phenos_of_interest_df = phenos_of_interest_df.loc[phenos_of_interest_df.Type.isin([pheno_type])]
+        fields = [(t, c, i, o, None) for t,c,i,o in zip(
+            phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group, 
+            phenos_of_interest_df.Phenotype_ID, phenos_of_interest_df.not_ordinal)]
+    # keep only the sorted sample ids with exome data, cached under the storage root after the first parse
+    exome_eids = ut.load_exome_eids(exome_file, pheno_storage_root)
+    exome_hash = ut.hash_array(exome_eids)
+    # the run manifest records the input hash of every binarized table along with the hash and stat of its raw table
+    manifest_path = ut.get_run_manifest_path(pheno_storage_root, pheno_type, shard)
+    manifest = ut.read_run_manifest(manifest_path)
     
-    pool_iter = [(exome_df, pheno_info_root, t, c, i, o, pheno_storage_root, strategy) for t,c,i,o in zip(
-        phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group, 
-        phenos_of_interest_df.Phenotype_ID, phenos_of_interest_df.not_ordinal)]
-
-    pool = mp.Pool(threads)
-    pool.starmap(create_binarized_table, pool_iter)
-    pool.close()
-    pool.join()
+    pool_iter = [
+        (
+            pheno_info_root, t, c, i, o, pheno_storage_root, strategies, 
+            [
+                manifest.get(ut.get_manifest_key(pheno_storage_root, get_binarized_table_path(pheno_storage_root, t, c, i, method, storage, f)))
+                for method in methods
+                ],
+            f
+            ) 
+        for t,c,i,o,f in fields
+        ]
+
+    # options shared by all the fields of the run
+    field_options = dict(
+        storage=storage, exome_hash=exome_hash, force=force, 
+        exome_only=exome_only, threshold_samples=threshold_samples, chunksize=chunksize, report=report,
+        exclude_negatives=exclude_negatives
+        )
+
+    # the largest raw tables are dispatched first
+    costs = [
+        f["cost"] if f is not None else ut.estimate_table_cost(ut.get_pheno_table_filepath(pheno_info_root, t, c, i, check_exists=False)) 
+        for _, t, c, i, *_, f in pool_iter
+        ]
+    if shard:
+        # keep only the fields of this shard, fields are split among the shards by balanced cost
+        shard_positions = ut.get_shard_positions(costs, shard)
+        pool_iter = [pool_iter[position] for position in shard_positions]
+        costs = [costs[position] for position in shard_positions]
+
+    n_threads = ut.get_n_threads(threads)
+    # the exome sample ids are shared once per worker by the pool initializer
+    pool_options = dict(initializer=ut.init_shared_exome_eids, initargs=(exome_eids,))
+    if prefetch:
+        # every worker runs a pipeline over a batch of fields that prefetches their inputs and 
+        # writes their tables in the background, a few batches per worker keep the load balanced
+        batches = ut.get_cost_balanced_batches(costs, n_threads * 4)
+        batch_iter = [([(position, pool_iter[position]) for position in batch],) for batch in batches]
+        batch_costs = [sum(costs[position] for position in batch) for batch in batches]
+        create_field_binarized_table_batch = functools.partial(create_binarized_table_batch, prefetch=prefetch, **field_options)
+        field_results = get_batch_field_results(
+            ut.imap_tasks_by_cost(create_field_binarized_table_batch, batch_iter, batch_costs, n_threads, **pool_options), batches
+            )
+    else:
+        create_field_binarized_table = functools.partial(create_binarized_table, **field_options)
+        field_results = ut.imap_tasks_by_cost(create_field_binarized_table, pool_iter, costs, n_threads, **pool_options)
+    failed_fields = []
+    field_reports = []
+    for position, result, error in field_results:
+        if error is not None:
+            print(f"Warning:: field id {pool_iter[position][3]} failed to binarize\n{error}")
+            failed_fields.append(pool_iter[position][3])
+            continue
+        binarized_tables, field_report = result
+        for binarized_table_path, manifest_entry in binarized_tables:
+            manifest[ut.get_manifest_key(pheno_storage_root, binarized_table_path)] = manifest_entry
+        if field_report is not None:
+            field_reports.append(field_report)
+    ut.write_run_manifest(manifest_path, manifest)
+    if report:
+        # the report is named like the run manifest
+        report_name = os.path.splitext(os.path.basename(manifest_path))[0]
+        ut.write_run_report(pheno_storage_root, report_name, field_reports, report_top_n)
+    if failed_fields:
+        print(f"Warning:: {len(failed_fields)} fields failed to binarize: {failed_fields}")
     return
 
 
@@ -74,7 +344,8 @@ if __name__ == "__main__":
         type=str, 
         help="""The file path of the manually prepared excel file that contains information about 
         the phenotypes' type (column name: Type), category (column name: Phenotype_group) and 
-        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal)"""
+        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal), 
+        or of the json field plan compiled from it by compile_field_plan.py"""
         )
     parser.add_argument(
         "id2exome_file", 
@@ -85,8 +356,77 @@ if __name__ == "__main__":
     parser.add_argument("pheno_info_root", type=str, help="The folder where previously downloaded fields and their encodings are stored")
     parser.add_argument("pheno_storage_root", type=str, help="The folder where binarized phenotype tables will be stored")
     parser.add_argument("pheno_type", type=str, help="The phenotype type which will be binarized eg: categorical_single/integer/continuous/categorical_multiple")
-    parser.add_argument("-s", "--strategy", type=str, help="The binarizing strategy for integer and continuous type; can be either quantile or median", default="")
-    parser.add_argument("-n", "--n_threads", type=int, help="number of cores to use", default=64)
+    parser.add_argument(
+        "-s", "--strategy", 
+        type=str, 
+        nargs="+", 
+        help="""The binarizing strategies for integer and continuous type; each one can be median, quantile, 
+        quantile:<low>:<high> or threshold:<low>:<high>. All of them are computed in the same run and saved 
+        as separate tables named after the strategy, for e.g. quantile:0.25:0.75 as <field>_quantile-0.25-0.75""", 
+        default=[""]
+        )
+    parser.add_argument("-n", "--n_threads", type=int, help="number of cores to use, defaults to the cpus allocated by SLURM", default=None)
+    parser.add_argument(
+        "--storage", 
+        type=str, 
+        choices=list(ut.STORAGE_FORMATS), 
+        help="""The storage format of the binarized tables; csv stores the full table, parquet and npy 
+        store only the binarized columns as uint8 with the eid index""", 
+        default="csv"
+        )
+    parser.add_argument(
+        "-f", "--force", 
+        action="store_true", 
+        help="Binarize all fields even if their inputs did not change since the last run"
+        )
+    parser.add_argument(
+        "--exome_only", 
+        action="store_true", 
+        help="Restrict the field values to the samples with exome data right after reading the raw field tables"
+        )
+    parser.add_argument(
+        "--threshold_samples", 
+        type=str, 
+        choices=["all", "exome"], 
+        help="""The samples used for computing the quantile thresholds and ordinal bins in exome only mode; 
+        all reproduces the results of the default mode, exome restricts all fields right after reading""", 
+        default="all"
+        )
+    parser.add_argument(
+        "-p", "--prefetch", 
+        type=int, 
+        help="""Pipeline the reading, binarizing and writing of the fields of every worker, prefetching the raw tables 
+        and encodings of up to this many upcoming fields in a reader thread while a writer thread saves the binarized tables; 
+        0 processes every field one stage after the other""", 
+        default=0
+        )
+    parser.add_argument(
+        "--shard", 
+        type=ut.parse_shard, 
+        help="""Binarize only the i-th of N shards of the fields, given as i/N with 1 <= i <= N. Fields are 
+        assigned to the shards by balanced cost, so N jobs with the same N binarize every field once""", 
+        default=None
+        )
+    parser.add_argument(
+        "-c", "--chunksize", 
+        type=int, 
+        help="""The number of rows of a raw field table parsed at a time before downcasting them to compact dtypes; 
+        0 reads the whole table at once with default dtypes""", 
+        default=ut.PHENO_TABLE_CHUNKSIZE
+        )
+    parser.add_argument(
+        "--report", 
+        action="store_true", 
+        help="""Record the wall time of every stage, peak memory, rows after every stage and the prevalence of every 
+        indicator column of each field into a json and csv run report under pheno_storage_root/reports"""
+        )
+    parser.add_argument("--report_top_n", type=int, help="The number of slowest fields listed in the run report", default=10)
+    parser.add_argument(
+        "--exclude_negatives", 
+        action="store_true", 
+        help="""Leave the negative codes (do not know, prefer not to answer) of the kept samples out of the mean 
+        of integer and continuous fields; by default every non null value of a kept sample is averaged"""
+        )
 
     args = parser.parse_args()
 
@@ -97,5 +437,15 @@ if __name__ == "__main__":
         args.pheno_storage_root, 
         args.pheno_type,
         args.strategy,
-        args.n_threads
+        args.n_threads,
+        args.storage,
+        args.force,
+        args.exome_only,
+        args.threshold_samples,
+        args.chunksize,
+        args.report,
+        args.report_top_n,
+        args.prefetch,
+        args.shard,
+        args.exclude_negatives
         )
@@ -4,63 +4,259 @@ FILE_OBJECTIVE = """Prepare meta table of binarized phenotypes"""
 
 import argparse
 import os
+import shutil
+import tempfile
 import pandas as pd
 import utils as ut
-import multiprocessing as mp
+import meta_store as ms
 
 
-def format_pheno_table(
-	exome_index, 
-	pheno_info_root, pheno_storage_root, pheno_type, pheno_cat, pheno_id, pheno_ordinality, strategy):
-
+def get_pheno_df_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, strategy, storage, field_plan=None):
 	if pheno_type in {"categorical_single", "categorical_multiple"}:
 		strategy = ""
+	if field_plan is not None:
+		return field_plan["binarized_tables"][ut.get_binarize_method(strategy)]
+	return ut.get_binarized_table_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, ut.get_binarize_method(strategy), storage)
+
+
+# the encodings are taken from the field plan when it was compiled with them
+def get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id, field_plan=None):
+	if field_plan is not None and field_plan["encodings"] is not None:
+		return ut.invert_pheno_encodings(field_plan["encodings"][0])
+	return ut.get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id)
 
-	pheno_df_path = ut.get_binarized_table_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, strategy)
+
+def get_ohe_encodings(pheno_storage_root, pheno_id, field_plan=None):
+	if field_plan is not None and field_plan["encodings"] is not None:
+		return ut.invert_pheno_encodings(field_plan["encodings"][1])
+	return ut.get_modified_field_encodings(pheno_storage_root, "ohe", pheno_id)
+
+
+def format_pheno_table(
+	exome_index, 
+	pheno_info_root, pheno_storage_root, pheno_type, pheno_cat, pheno_id, pheno_ordinality, strategy, storage="csv", field_plan=None, field_report=None):
+
+	# opt-in per field instrumentation, a disabled report records nothing
+	field_report = field_report if field_report is not None else ut.FieldReport(pheno_id, pheno_type, enabled=False)
+	pheno_df_path = get_pheno_df_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, strategy, storage, field_plan)
 	pheno_df = ut.read_binarized_table(pheno_df_path)
+	field_report.lap("read", pheno_df)
 	col_df = pd.DataFrame()
 
 	if pheno_type in {"integer", "continuous", "categorical_single"}:
 		if pd.isnull(pheno_ordinality):
 			pheno_df, col_df =  ut.reindex_binarized_table1(pheno_df, pheno_id, exome_index)
 		elif pheno_ordinality == "O":
-			pheno_encodings = ut.get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id)
+			pheno_encodings = get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id, field_plan)
 			if type(pheno_encodings) == dict:
 				pheno_df, col_df =  ut.reindex_binarized_table2(pheno_df, pheno_id, pheno_encodings, exome_index)			
 		elif pheno_ordinality == "B":
-			ohe_encodings = ut.get_modified_field_encodings(pheno_storage_root, "ohe", pheno_id)
+			ohe_encodings = get_ohe_encodings(pheno_storage_root, pheno_id, field_plan)
 			pheno_df, col_df =  ut.reindex_binarized_table3(pheno_df, pheno_id, ohe_encodings, exome_index)			
 
 	elif pheno_type in {"categorical_multiple"}:
-		pheno_encodings = ut.get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id)
+		pheno_encodings = get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id, field_plan)
 		if type(pheno_encodings) == dict:
 			pheno_df, col_df =  ut.reindex_binarized_table2(pheno_df, pheno_id, pheno_encodings, exome_index)
+	field_report.lap("reindex", pheno_df)
 	return pheno_df, col_df
 
 
-def main(phenos_of_interest_file, exome_file, pheno_info_root, pheno_storage_root, strategy):
+def store_pheno_table(store_dir, report, *format_args):
+	"""
+	Formats a field and packs its reindexed table into a block of the meta table 
+	store right away, so only the small column maps and the field report are 
+	sent back to the main process
+	"""
+	pheno_type, pheno_id = format_args[3], format_args[5]
+	field_report = ut.FieldReport(pheno_id, pheno_type, enabled=report)
+	pheno_df, col_df = format_pheno_table(*format_args, field_report=field_report)
+	if pheno_df.empty:
+		return None, None, field_report.to_dict()
+	field_report.count_indicators(pheno_df, list(pheno_df.columns))
+	block_col_df = ms.write_block(store_dir, pheno_id, pheno_df, col_df)
+	field_report.lap("pack")
+	return col_df, block_col_df, field_report.to_dict()
+
+
+def get_field_build_entry(pheno_info_root, pheno_storage_root, pheno_type, pheno_cat, pheno_id, pheno_ordinality, strategy, storage, field_plan, prev_entry):
+	"""
+	Returns the build manifest entry of a field with the hash of all the inputs that determine its 
+	meta table columns; the binarized table is only hashed again when its size or mtime changed
+	"""
+	pheno_df_path = get_pheno_df_path(pheno_storage_root, pheno_type, pheno_cat, pheno_id, strategy, storage, field_plan)
+	table_paths = [pheno_df_path, ut.get_npy_sidecar_path(pheno_df_path)] if storage == "npy" else [pheno_df_path]
+	table_stat = [[os.stat(p).st_size, os.stat(p).st_mtime_ns] for p in table_paths]
+	if prev_entry.get("table_stat") == table_stat:
+		table_hash = prev_entry["table_hash"]
+	else:
+		table_hash = [ut.hash_file(p) for p in table_paths]
+	pheno_encodings = None
+	if pheno_type == "categorical_multiple" or (pheno_type == "categorical_single" and pheno_ordinality == "O"):
+		pheno_encodings = get_field_encodings(pheno_info_root, pheno_type, pheno_cat, pheno_id, field_plan)
+	elif pheno_type == "categorical_single" and pheno_ordinality == "B":
+		pheno_encodings = get_ohe_encodings(pheno_storage_root, pheno_id, field_plan)
+	field_hash = ut.hash_field_inputs(
+		table=ut.get_manifest_key(pheno_storage_root, pheno_df_path), 
+		table_hash=table_hash, 
+		ordinality=None if pd.isnull(pheno_ordinality) else pheno_ordinality, 
+		encodings=pheno_encodings
+		)
+	return {"hash": field_hash, "table_hash": table_hash, "table_stat": table_stat}
+
+
+def get_update_fields(store_dir, exome_index, pool_iter):
+	"""
+	Compares the fields of the phenos of interest file against the build manifest of the store 
+	and returns the build manifest entries and stored columns of all fields along with the positions 
+	of the fields added or changed since the last build, or whose stored columns can not be reused. 
+	A store built for other samples is rebuilt from scratch
+	"""
+	build_manifest = ms.read_build_manifest(store_dir)
+	eids_hash = ut.hash_array(exome_index.to_numpy(dtype="int64"))
+	if build_manifest["eids"] != eids_hash or not os.path.exists(os.path.join(store_dir, "store.json")):
+		shutil.rmtree(store_dir, ignore_errors=True)
+		ms.write_store_index(store_dir, exome_index)
+		build_manifest = {"eids": eids_hash, "fields": {}}
+	prev_field_cols = ms.read_field_columns(store_dir)
+	field_entries = {}
+	stale_positions = []
+	for position, (_, pheno_info_root, pheno_storage_root, t, c, i, o, s, st, f) in enumerate(pool_iter):
+		prev_entry = build_manifest["fields"].get(str(i), {})
+		try:
+			field_entries[position] = get_field_build_entry(pheno_info_root, pheno_storage_root, t, c, i, o, s, st, f, prev_entry)
+		except Exception:
+			# fields whose inputs can not be read are formatted again, and fail there
+			field_entries[position] = None
+		if field_entries[position] is None or field_entries[position]["hash"] != prev_entry.get("hash"):
+			stale_positions.append(position)
+		elif str(i) in prev_field_cols and not ms.check_field_columns(store_dir, str(i), *prev_field_cols[str(i)]):
+			stale_positions.append(position)
+	return build_manifest, field_entries, prev_field_cols, stale_positions
+
+
+def main(phenos_of_interest_file, exome_file, pheno_info_root, pheno_storage_root, strategy, storage, meta_format, memory_budget, threads, report, report_top_n, shard, update):
 	
-	# read phenos of interest df
-	phenos_of_interest_df = ut.read_phenos_of_interest_data(phenos_of_interest_file)
-	# get exome index
-	exome_index = ut.get_exome_index(exome_file)
+	if ut.is_field_plan(phenos_of_interest_file):
+		# the fields with their paths, encodings and costs compiled by compile_field_plan.py
+		field_plan = ut.read_field_plan(phenos_of_interest_file, pheno_info_root, pheno_storage_root, storage)
+		fields = ut.get_plan_fields(field_plan)
+		method = ut.get_binarize_method(strategy)
+		for t, _, i, _, f in fields:
+			if t in {"integer", "continuous"} and method not in f["binarized_tables"]:
+				raise ValueError(f"The field plan has no binarized table of the strategy {strategy} for field {i}, compile it with it")
+	else:
+		# read phenos of interest df
+		phenos_of_interest_df = ut.read_phenos_of_interest_data(phenos_of_interest_file)
+		fields = [(t, c, i, o, None) for t,c,i,o in zip(
+			phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group, 
+			phenos_of_interest_df.Phenotype_ID, phenos_of_interest_df.not_ordinal)]
+	# get exome index in the order of the exome file, cached under the storage root after the first parse
+	exome_index = ut.load_exome_index(exome_file, pheno_storage_root)
+
+	pool_iter = [(exome_index, pheno_info_root, pheno_storage_root, t, c, i, o, strategy, storage, f) for t,c,i,o,f in fields]
 
-	pool_iter = [(exome_index, pheno_info_root, pheno_storage_root, t, c, i, o, strategy) for t,c,i,o in zip(
- 		phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group, 
-        phenos_of_interest_df.Phenotype_ID, phenos_of_interest_df.not_ordinal)]
+	# the largest binarized tables are dispatched first, planned fields by the cost of their raw tables
+	costs = [
+		f["cost"] if f is not None else ut.estimate_table_cost(get_pheno_df_path(pheno_storage_root, t, c, i, s, st)) 
+		for _, _, _, t, c, i, _, s, st, f in pool_iter
+		]
+	positions = list(range(len(pool_iter)))
+	if shard:
+		# keep only the fields of this shard, fields are split among the shards by balanced cost
+		positions = ut.get_shard_positions(costs, shard)
+	if update:
+		# keep only the fields added or changed since the last build of the store
+		build_manifest, field_entries, prev_field_cols, positions = get_update_fields(ms.get_meta_store_dir(pheno_storage_root), exome_index, pool_iter)
+		print(f"Updating {len(positions)} of {len(pool_iter)} fields of the meta table")
 
-	pool = mp.Pool(64)
-	pheno_dfs = [pdf for pdf in list(pool.starmap(format_pheno_table, pool_iter)) if not pdf[0].empty]
-	pool.close()
-	pool.join()
+	# fields are packed into blocks of a meta table store as they complete, for the csv 
+	# format the store is a temporary one that is streamed into the csv in row chunks
+	if shard:
+		# a shard store is always written from scratch so that an incomplete one is never merged
+		store_dir = ms.get_shard_store_dir(pheno_storage_root, shard)
+		shutil.rmtree(store_dir, ignore_errors=True)
+	elif update:
+		# the store of an update run is persistent, the blocks of the updated fields are overwritten in place
+		store_dir = ms.get_meta_store_dir(pheno_storage_root)
+	elif meta_format == "bitpacked":
+		# a full run replaces the whole store, so that the build manifest of an earlier update run is never reused
+		store_dir = ms.get_meta_store_dir(pheno_storage_root)
+		shutil.rmtree(store_dir, ignore_errors=True)
+	else:
+		store_dir = tempfile.mkdtemp(prefix="meta_pheno_table3_", dir=pheno_storage_root)
+	# the temporary store of the csv format is removed even if the run fails
+	temp_store = not (shard or update or meta_format == "bitpacked")
+	try:
+		ms.write_store_index(store_dir, exome_index)
 
-	meta_df = pd.concat([pdf[0] for pdf in pheno_dfs], axis=1, join="inner")
-	meta_df_path = os.path.join(pheno_storage_root, "meta_pheno_table3.csv")
-	meta_df.to_csv(meta_df_path)
+		pheno_cols = {}
+		failed_fields = []
+		field_reports = []
+		store_iter = [(store_dir, report, *pool_iter[position]) for position in positions]
+		for task_position, result, error in ut.imap_tasks_by_cost(store_pheno_table, store_iter, [costs[position] for position in positions], ut.get_n_threads(threads)):
+			position = positions[task_position]
+			if error is not None:
+				print(f"Warning:: field id {pool_iter[position][5]} failed to format and is missing from the meta table\n{error}")
+				failed_fields.append(pool_iter[position][5])
+				continue
+			if result[2] is not None:
+				field_reports.append(result[2])
+			if result[0] is not None:
+				pheno_cols[position] = result[:2]
+		if failed_fields:
+			print(f"Warning:: {len(failed_fields)} fields are missing from the meta table: {failed_fields}")
 
-	meta_col_df = pd.concat([cdf[1] for cdf in pheno_dfs], axis=0)
-	meta_col_df_path = os.path.join(pheno_storage_root, "meta_pheno_table_cols3.csv")
-	meta_col_df.to_csv(meta_col_df_path, index=False)
+		if shard:
+			# the column maps keep the positions of the fields, the shards are merged into 
+			# the meta outputs by 2_merge_meta_shards.py
+			ms.write_shard_columns(store_dir, shard, pheno_cols)
+		elif update:
+			# unchanged fields keep their blocks and columns, the rest are patched with the formatted ones
+			field_cols = []
+			build_manifest["fields"] = {}
+			for position, (_, _, _, _, _, i, _, _, _, _) in enumerate(pool_iter):
+				if position in pheno_cols:
+					field_cols.append((str(i), *pheno_cols[position]))
+				elif position not in positions and str(i) in prev_field_cols:
+					field_cols.append((str(i), *prev_field_cols[str(i)]))
+				elif str(i) in prev_field_cols:
+					# a field that failed or no longer has meta table columns
+					ms.remove_block(store_dir, i)
+				if i not in failed_fields and field_entries[position] is not None:
+					build_manifest["fields"][str(i)] = field_entries[position]
+			# fields removed from the phenos of interest file
+			current_blocks = {str(field_args[5]) for field_args in pool_iter}
+			for block in set(prev_field_cols) - current_blocks:
+				ms.remove_block(store_dir, block)
+			ms.write_field_columns(store_dir, field_cols)
+			ms.write_build_manifest(store_dir, build_manifest)
+
+			if meta_format == "csv":
+				# a row major csv can not be patched in place, it is streamed again from the patched store
+				meta_df_path = os.path.join(pheno_storage_root, "meta_pheno_table3.csv")
+				ms.write_meta_csv(store_dir, meta_df_path, memory_budget)
+
+			meta_col_df = pd.concat([cdf[1] for cdf in field_cols], axis=0)
+			meta_col_df_path = os.path.join(pheno_storage_root, "meta_pheno_table_cols3.csv")
+			meta_col_df.to_csv(meta_col_df_path, index=False)
+		else:
+			# keep the columns in the order of the phenos of interest file
+			pheno_cols = [pheno_cols[position] for position in sorted(pheno_cols)]
+			ms.write_store_columns(store_dir, [cdf[1] for cdf in pheno_cols])
+
+			if meta_format == "csv":
+				meta_df_path = os.path.join(pheno_storage_root, "meta_pheno_table3.csv")
+				ms.write_meta_csv(store_dir, meta_df_path, memory_budget)
+
+			meta_col_df = pd.concat([cdf[0] for cdf in pheno_cols], axis=0)
+			meta_col_df_path = os.path.join(pheno_storage_root, "meta_pheno_table_cols3.csv")
+			meta_col_df.to_csv(meta_col_df_path, index=False)
+	finally:
+		if temp_store:
+			shutil.rmtree(store_dir, ignore_errors=True)
+	if report:
+		ut.write_run_report(pheno_storage_root, f"prepare_meta{ut.get_shard_suffix(shard)}", field_reports, report_top_n)
 
 	return
 
@@ -72,7 +268,8 @@ if __name__ == "__main__":
 		type=str, 
         help="""The file path of the manually prepared excel file that contains information about 
         the phenotypes' type (column name: Type), category (column name: Phenotype_group) and 
-        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal)"""
+        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal), 
+        or of the json field plan compiled from it by compile_field_plan.py"""
         )
 	parser.add_argument(
         "id2exome_file", 
@@ -82,13 +279,67 @@ if __name__ == "__main__":
         )
 	parser.add_argument("pheno_info_root", type=str, help="The folder where previously downloaded fields and their encodings are stored")
 	parser.add_argument("pheno_storage_root", type=str, help="The folder where binarized phenotype tables are stored and the meta table will be stored")
-	parser.add_argument("-s", "--strategy", type=str, help="The binarizing strategy for integer and continuous type; can be either quantile or median", default="quantile")
+	parser.add_argument("-s", "--strategy", type=str, help="The binarizing strategy for integer and continuous type; can be median, quantile, quantile:<low>:<high> or threshold:<low>:<high>", default="quantile")
+	parser.add_argument(
+		"--storage", 
+		type=str, 
+		choices=list(ut.STORAGE_FORMATS), 
+		help="The storage format the binarized tables were saved in", 
+		default="csv"
+		)
+	parser.add_argument(
+		"--meta_format", 
+		type=str, 
+		choices=["csv", "bitpacked"], 
+		help="""The output format of the meta table; csv writes meta_pheno_table3.csv, bitpacked writes 
+		the meta_pheno_table3 directory with 2 bits per cell (0/1/missing) along with eid and column index files""", 
+		default="csv"
+		)
+	parser.add_argument(
+		"-m", "--memory_budget", 
+		type=int, 
+		help="The memory budget in MB used for writing the csv meta table in chunks of rows", 
+		default=1024
+		)
+	parser.add_argument("-n", "--n_threads", type=int, help="number of cores to use, defaults to the cpus allocated by SLURM", default=None)
+	parser.add_argument(
+		"--report", 
+		action="store_true", 
+		help="""Record the wall time of every stage, peak memory, rows after every stage and the prevalence of every 
+		meta table column of each field into a json and csv run report under pheno_storage_root/reports"""
+		)
+	parser.add_argument("--report_top_n", type=int, help="The number of slowest fields listed in the run report", default=10)
+	parser.add_argument(
+		"--shard", 
+		type=ut.parse_shard, 
+		help="""Format only the i-th of N shards of the fields, given as i/N with 1 <= i <= N, into the partial meta table 
+		store meta_pheno_table3.shard<i>of<N>. Fields are assigned to the shards by balanced cost, and the N partial 
+		stores are combined into the meta outputs by 2_merge_meta_shards.py""", 
+		default=None
+		)
+	parser.add_argument(
+		"--update", 
+		action="store_true", 
+		help="""Only format the fields added or changed since the last update run and patch them into the persistent 
+		meta table store meta_pheno_table3 along with its build manifest, removed fields are dropped from it. 
+		The csv meta table is then written again from the store""", 
+		)
 	args = parser.parse_args()
+	if args.update and args.shard:
+		parser.error("--update can not be combined with --shard")
 
 	main(
 		args.phenos_of_interest_file,
 		args.id2exome_file, 
 		args.pheno_info_root,
 		args.pheno_storage_root,
-		args.strategy
+		args.strategy,
+		args.storage,
+		args.meta_format,
+		args.memory_budget,
+		args.n_threads,
+		args.report,
+		args.report_top_n,
+		args.shard,
+		args.update
 		)
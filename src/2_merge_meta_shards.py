@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+FILE_OBJECTIVE = """Merge the partial meta tables of a sharded 1_prepare_meta.py run into the meta table"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import meta_store as ms
+
+
+def main(pheno_storage_root, n_shards, meta_format, memory_budget, keep_shards):
+
+    shard_dirs = [ms.get_shard_store_dir(pheno_storage_root, (shard_idx, n_shards)) for shard_idx in range(1, n_shards + 1)]
+    # all the shards are validated before any output is replaced
+    shard_columns = ms.validate_shard_stores(shard_dirs, n_shards)
+    # the shards are merged into a single store with the columns in the order of the
+    # phenos of interest file, for the csv format the store is a temporary one
+    if meta_format == "bitpacked":
+        store_dir = ms.get_meta_store_dir(pheno_storage_root)
+        shutil.rmtree(store_dir, ignore_errors=True)
+    else:
+        store_dir = tempfile.mkdtemp(prefix="meta_pheno_table3_", dir=pheno_storage_root)
+    try:
+        meta_col_df = ms.merge_shard_stores(store_dir, *shard_columns)
+
+        if meta_format == "csv":
+            meta_df_path = os.path.join(pheno_storage_root, "meta_pheno_table3.csv")
+            ms.write_meta_csv(store_dir, meta_df_path, memory_budget)
+    finally:
+        # the temporary store of the csv format is removed even if the merge fails
+        if meta_format == "csv":
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+    meta_col_df_path = os.path.join(pheno_storage_root, "meta_pheno_table_cols3.csv")
+    meta_col_df.to_csv(meta_col_df_path, index=False)
+
+    if not keep_shards:
+        for shard_dir in shard_dirs:
+            shutil.rmtree(shard_dir)
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=FILE_OBJECTIVE)
+    parser.add_argument("pheno_storage_root", type=str, help="The folder where the partial meta tables are stored and the meta table will be stored")
+    parser.add_argument("n_shards", type=int, help="The number of shards N of the sharded run, all the shards 1/N to N/N are merged")
+    parser.add_argument(
+        "--meta_format",
+        type=str,
+        choices=["csv", "bitpacked"],
+        help="""The output format of the meta table; csv writes meta_pheno_table3.csv, bitpacked writes
+        the meta_pheno_table3 directory with 2 bits per cell (0/1/missing) along with eid and column index files""",
+        default="csv"
+        )
+    parser.add_argument(
+        "-m", "--memory_budget",
+        type=int,
+        help="The memory budget in MB used for writing the csv meta table in chunks of rows",
+        default=1024
+        )
+    parser.add_argument("--keep_shards", action="store_true", help="Keep the partial meta tables after merging them")
+
+    args = parser.parse_args()
+
+    main(
+        args.pheno_storage_root,
+        args.n_shards,
+        args.meta_format,
+        args.memory_budget,
+        args.keep_shards
+        )
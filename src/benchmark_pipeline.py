@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+FILE_OBJECTIVE = """Time every stage of the binarizing pipeline per field and both entry points end to end, and compare against a previous benchmark"""
+
+import argparse
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import importlib
+import subprocess
+import numpy as np
+import pandas as pd
+import utils as ut
+
+
+# quantiles used by the quantile binarizing strategy, same as 0_binarize_phenos.py
+QUANTILE_LOW = 0.05
+QUANTILE_HIGH = 0.95
+STAGES = ["read", "filter_negatives", "merge", "binarize", "exome_filter", "save", "reindex"]
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_benchmark_path(pheno_storage_root, label):
+    return os.path.join(pheno_storage_root, "benchmarks", f"{label}.json")
+
+
+def make_scratch_storage_root(pheno_storage_root):
+    """
+    Returns a temporary storage root with the modified field encodings of the
+    storage root, so that the benchmark never overwrites the binarized tables
+    """
+    os.makedirs(os.path.join(pheno_storage_root, "benchmarks"), exist_ok=True)
+    scratch_root = tempfile.mkdtemp(dir=os.path.join(pheno_storage_root, "benchmarks"))
+    modified_encodings_dir = os.path.join(pheno_storage_root, "modified_field_encodings")
+    if os.path.exists(modified_encodings_dir):
+        shutil.copytree(modified_encodings_dir, os.path.join(scratch_root, "modified_field_encodings"))
+    return scratch_root
+
+
+def time_field_stages(
+    prepare_meta, exome_eids, exome_index, pheno_info_root, pheno_storage_root, scratch_root,
+    pheno_type, pheno_cat, pheno_id, pheno_ordinal, strategy, storage, chunksize
+    ):
+    """
+    Runs the utils stages of both scripts on one field and returns the seconds spent in each stage
+    """
+    stage_times = {}
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        stage_times[stage] = time.perf_counter() - start
+        return result
+
+    pheno_encodings, ohe_encodings, ordinal_encodings = None, None, None
+    if pheno_type in {"categorical_single", "categorical_multiple"}:
+        pheno_encodings = ut.read_pheno_encodings(ut.get_pheno_encoding_filepath(pheno_info_root, pheno_type, pheno_cat), pheno_id)
+        if pheno_ordinal == "B":
+            ohe_encodings = ut.read_pheno_encodings(ut.get_modified_pheno_encoding_filepath(pheno_storage_root, "ohe"), pheno_id)
+            ordinal_encodings = ut.read_pheno_encodings(ut.get_modified_pheno_encoding_filepath(pheno_storage_root, "ordinal"), pheno_id)
+    method = strategy if pheno_type in {"integer", "continuous"} else ""
+
+    pheno_table_path = ut.get_pheno_table_filepath(pheno_info_root, pheno_type, pheno_cat, pheno_id)
+    pheno_all_df = timed("read", ut.read_pheno_table, pheno_table_path, chunksize)
+    if pheno_type in {"categorical_single", "categorical_multiple"}:
+        pheno_no_negative_vals_df = timed("filter_negatives", ut.filter_pheno_table_no_negs, pheno_all_df, pheno_type)
+        pheno_merged_fields_df = timed("merge", ut.merge_values_categorical, pheno_no_negative_vals_df, pheno_type)
+        pheno_binarized_df = timed(
+            "binarize", ut.binarize_categoricals,
+            pheno_merged_fields_df, pheno_type, pheno_encodings, pheno_ordinal, ohe_encodings, ordinal_encodings
+            )
+    else:
+        # same as 0_binarize_phenos.py, numerical fields are filtered and merged in one pass
+        pheno_merged_fields_df = timed("filter_negatives", ut.filter_merge_values_numerical, pheno_all_df, pheno_type)
+        stage_times["merge"] = 0.0
+        pheno_binarized_df = timed(
+            "binarize", ut.binarize_numericals,
+            pheno_merged_fields_df, strategy=strategy, quantile_low=QUANTILE_LOW, quantile_high=QUANTILE_HIGH
+            )
+    pheno_binarized_df = timed("exome_filter", ut.filter_pheno_with_exomes, pheno_binarized_df, exome_eids)
+    timed("save", ut.save_pheno_table, pheno_binarized_df, scratch_root, pheno_type, pheno_cat, pheno_id, method, storage)
+    # reading the saved binarized table back is part of the reindex stage of 1_prepare_meta.py
+    timed(
+        "reindex", prepare_meta.format_pheno_table,
+        exome_index, pheno_info_root, scratch_root, pheno_type, pheno_cat, pheno_id, pheno_ordinal, strategy, storage
+        )
+    stage_times["rows"], stage_times["cols"] = pheno_all_df.shape
+    return stage_times
+
+
+def run_script(script, *args):
+    """
+    Runs an entry point of the pipeline and returns the wall time in seconds
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script), *[str(a) for a in args]], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def time_end_to_end(phenos_of_interest_file, exome_file, pheno_info_root, pheno_types, strategy, storage, threads, scratch_root):
+    """
+    Runs 0_binarize_phenos.py for every field type and then 1_prepare_meta.py on the scratch storage root
+    """
+    common_args = [phenos_of_interest_file, exome_file, pheno_info_root, scratch_root]
+    thread_args = ["-n", threads] if threads else []
+    end_to_end_times = {}
+    for pheno_type in pheno_types:
+        strategy_args = ["-s", strategy] if pheno_type in {"integer", "continuous"} else []
+        end_to_end_times[f"0_binarize_phenos.py {pheno_type}"] = run_script(
+            "0_binarize_phenos.py", *common_args, pheno_type, *strategy_args, "--storage", storage, "--force", *thread_args
+            )
+    end_to_end_times["1_prepare_meta.py"] = run_script(
+        "1_prepare_meta.py", *common_args, "-s", strategy, "--storage", storage, *thread_args
+        )
+    return end_to_end_times
+
+
+def compare_benchmarks(baseline, current, tolerance):
+    """
+    Returns a table of the total stage and end to end times of the baseline and current
+    benchmarks, where the ones slower than the baseline by more than the tolerance are flagged
+    """
+    rows = []
+    for kind in ["stages", "end_to_end"]:
+        for name, current_time in current[kind].items():
+            baseline_time = baseline.get(kind, {}).get(name, np.nan)
+            ratio = current_time / baseline_time if baseline_time else np.nan
+            rows.append((kind, name, baseline_time, current_time, ratio, bool(ratio > 1 + tolerance)))
+    return pd.DataFrame(rows, columns=["kind", "name", "baseline", "current", "ratio", "regression"])
+
+
+def main(
+    phenos_of_interest_file, exome_file, pheno_info_root, pheno_storage_root, label, n_fields,
+    repeats, strategy, storage, chunksize, end_to_end, threads, baseline_file, tolerance
+    ):
+
+    phenos_of_interest_df = ut.read_phenos_of_interest_data(phenos_of_interest_file)
+    if phenos_of_interest_df.empty:
+        raise ValueError(
+            f"No field of {phenos_of_interest_file} is shortlisted with enough exome samples "
+            "(column name: Num_exome_samples_with_phenotype), there is nothing to benchmark"
+            )
+    pheno_types = list(phenos_of_interest_df.Type.unique())
+    # the first fields of every type are benchmarked
+    if n_fields:
+        phenos_of_interest_df = phenos_of_interest_df.groupby("Type", sort=False).head(n_fields)
+    exome_eids = ut.load_exome_eids(exome_file, pheno_storage_root)
+    exome_index = ut.load_exome_index(exome_file, pheno_storage_root)
+    prepare_meta = importlib.import_module("1_prepare_meta")
+
+    scratch_root = make_scratch_storage_root(pheno_storage_root)
+    field_times = []
+    try:
+        for t, c, i, o in zip(
+            phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group,
+            phenos_of_interest_df.Phenotype_ID, phenos_of_interest_df.not_ordinal):
+            # the fastest of the repeats is kept for every stage
+            repeat_times = [
+                time_field_stages(prepare_meta, exome_eids, exome_index, pheno_info_root, pheno_storage_root, scratch_root, t, c, i, o, strategy, storage, chunksize)
+                for _ in range(repeats)
+                ]
+            field_times.append({"pheno_id": int(i), "pheno_type": t, **pd.DataFrame(repeat_times).min().to_dict()})
+    finally:
+        shutil.rmtree(scratch_root)
+    field_times_df = pd.DataFrame(field_times)
+
+    end_to_end_times = {}
+    if end_to_end:
+        scratch_root = make_scratch_storage_root(pheno_storage_root)
+        try:
+            end_to_end_times = time_end_to_end(
+                phenos_of_interest_file, exome_file, pheno_info_root,
+                pheno_types, strategy, storage, threads, scratch_root
+                )
+        finally:
+            shutil.rmtree(scratch_root)
+
+    benchmark = {
+        "label": label,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {
+            "n_fields": len(field_times_df), "n_exome_samples": len(exome_eids), "repeats": repeats,
+            "strategy": strategy, "storage": storage, "chunksize": chunksize, "threads": threads,
+            },
+        "versions": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__},
+        "stages": {stage: float(field_times_df[stage].sum()) for stage in STAGES},
+        "end_to_end": end_to_end_times,
+        "fields": field_times_df.to_dict(orient="records"),
+        }
+    benchmark_path = get_benchmark_path(pheno_storage_root, label)
+    with open(benchmark_path, "w") as f:
+        json.dump(benchmark, f, indent=1)
+    print(f"Benchmark saved to {benchmark_path}")
+    print(pd.Series({**benchmark["stages"], **end_to_end_times}, name="seconds").to_string())
+
+    if baseline_file:
+        with open(baseline_file, "r") as f:
+            baseline = json.load(f)
+        comparison_df = compare_benchmarks(baseline, benchmark, tolerance)
+        print(comparison_df.to_string(index=False))
+        if comparison_df.regression.any():
+            print(f"Warning:: {comparison_df.regression.sum()} timings are slower than the baseline by more than {tolerance:.0%}")
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=FILE_OBJECTIVE)
+    parser.add_argument(
+        "phenos_of_interest_file",
+        type=str,
+        help="""The file path of the manually prepared excel file that contains information about
+        the phenotypes' type (column name: Type), category (column name: Phenotype_group) and
+        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal)"""
+        )
+    parser.add_argument(
+        "id2exome_file",
+        type=str,
+        help="""The file path of the csv file downloaded from UKB that maps sample ids to their
+        exome vcf values"""
+        )
+    parser.add_argument("pheno_info_root", type=str, help="The folder where previously downloaded fields and their encodings are stored")
+    parser.add_argument(
+        "pheno_storage_root",
+        type=str,
+        help="""The folder with the modified field encodings; the benchmark results are stored under benchmarks
+        and all tables are written to a temporary folder there"""
+        )
+    parser.add_argument("-l", "--label", type=str, help="The name of the benchmark results file", default="benchmark")
+    parser.add_argument("--n_fields", type=int, help="The number of fields of every type to benchmark, all fields by default", default=0)
+    parser.add_argument("-r", "--repeats", type=int, help="The number of times every field is run, the fastest run is kept", default=1)
+    parser.add_argument("-s", "--strategy", type=str, help="The binarizing strategy for integer and continuous type", default="quantile")
+    parser.add_argument("--storage", type=str, choices=list(ut.STORAGE_FORMATS), help="The storage format of the binarized tables", default="csv")
+    parser.add_argument("-c", "--chunksize", type=int, help="The number of rows of a raw field table parsed at a time", default=ut.PHENO_TABLE_CHUNKSIZE)
+    parser.add_argument("--end_to_end", action="store_true", help="Also time both scripts on all the fields of the phenos of interest file")
+    parser.add_argument("-n", "--n_threads", type=int, help="number of cores used by the scripts in the end to end run", default=None)
+    parser.add_argument("-b", "--baseline", type=str, help="The results file of a previous benchmark to compare against", default=None)
+    parser.add_argument("--tolerance", type=float, help="The fraction by which a timing can exceed the baseline before it is flagged", default=0.1)
+
+    args = parser.parse_args()
+
+    main(
+        args.phenos_of_interest_file,
+        args.id2exome_file,
+        args.pheno_info_root,
+        args.pheno_storage_root,
+        args.label,
+        args.n_fields,
+        args.repeats,
+        args.strategy,
+        args.storage,
+        args.chunksize,
+        args.end_to_end,
+        args.n_threads,
+        args.baseline,
+        args.tolerance
+        )
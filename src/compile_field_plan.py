@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+FILE_OBJECTIVE = """Compile the phenos of interest file into a field plan that both stages take in its place"""
+
+import argparse
+import utils as ut
+
+
+def main(phenos_of_interest_file, pheno_info_root, pheno_storage_root, strategies, storage, plan_file):
+    field_plan = ut.compile_field_plan(phenos_of_interest_file, pheno_info_root, pheno_storage_root, strategies, storage)
+    plan_file = plan_file if plan_file else ut.get_field_plan_path(pheno_storage_root)
+    ut.write_field_plan(plan_file, field_plan)
+    n_without_encodings = sum(
+        f["pheno_type"] in {"categorical_single", "categorical_multiple"} and f["encodings"] is None for f in field_plan["fields"]
+        )
+    if n_without_encodings:
+        print(f"Warning:: {n_without_encodings} categorical fields were planned without their encodings")
+    print(f"Field plan of {len(field_plan['fields'])} fields saved to {plan_file}")
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=FILE_OBJECTIVE)
+    parser.add_argument(
+        "phenos_of_interest_file", 
+        type=str, 
+        help="""The file path of the manually prepared excel file that contains information about 
+        the phenotypes' type (column name: Type), category (column name: Phenotype_group) and 
+        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal)"""
+        )
+    parser.add_argument("pheno_info_root", type=str, help="The folder where previously downloaded fields and their encodings are stored")
+    parser.add_argument("pheno_storage_root", type=str, help="The folder where binarized phenotype tables will be stored")
+    parser.add_argument(
+        "-s", "--strategy", 
+        type=str, 
+        nargs="+", 
+        help="""The binarizing strategies of integer and continuous types whose binarized table paths are planned, 
+        both stages must be run with strategies among them""", 
+        default=["quantile"]
+        )
+    parser.add_argument(
+        "--storage", 
+        type=str, 
+        choices=list(ut.STORAGE_FORMATS), 
+        help="The storage format of the binarized tables, both stages must be run with the same one", 
+        default="csv"
+        )
+    parser.add_argument(
+        "-o", "--plan_file", 
+        type=str, 
+        help="The file path of the json field plan, defaults to pheno_storage_root/plans/field_plan.json", 
+        default=None
+        )
+
+    args = parser.parse_args()
+
+    main(
+        args.phenos_of_interest_file,
+        args.pheno_info_root,
+        args.pheno_storage_root,
+        args.strategy,
+        args.storage,
+        args.plan_file
+        )
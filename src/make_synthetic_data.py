@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+FILE_OBJECTIVE = """Generate synthetic UKB shaped field tables, encodings, phenos of interest and exome files for benchmarking"""
+
+import argparse
+import os
+import json
+import numpy as np
+import pandas as pd
+import utils as ut
+
+
+# the fraction of generated fields of each type
+FIELD_TYPE_FRACTIONS = {
+    "integer": 0.2,
+    "continuous": 0.2,
+    "categorical_single": 0.4,
+    "categorical_multiple": 0.2,
+}
+# UKB negative codes: do not know, prefer not to answer and none of the above
+NEGATIVE_CODES = {-1: "Do not know", -3: "Prefer not to answer"}
+NONE_OF_THE_ABOVE_CODE = -7
+FIRST_FIELD_ID = 100000
+FIELDS_PER_CATEGORY = 50
+# the minimum number of exome samples of a field kept by ut.read_phenos_of_interest_data
+PHENOS_OF_INTEREST_MIN_SAMPLES = 2000
+
+
+def get_field_columns(pheno_id, n_instances, n_arrays):
+    return [f"{pheno_id}-{i}.{a}" for i in range(n_instances) for a in range(n_arrays)]
+
+
+def get_field_encodings(n_codes, negatives):
+    """
+    Returns the field encodings of codes 1 to n_codes along with the negative codes
+    """
+    encodings = {str(code): f"Answer {code}" for code in range(1, n_codes + 1)}
+    encodings.update({str(code): label for code, label in negatives.items()})
+    return encodings
+
+
+def make_field_values(rng, pheno_type, n_samples, n_cols, n_codes, missing_fraction):
+    """
+    Returns the values of a field with shape (samples, instances x arrays). Repeat instances
+    mostly agree with the first one, so that merging keeps most of the samples
+    """
+    codes = np.arange(1, n_codes + 1)
+    if pheno_type == "integer":
+        values = rng.integers(0, 50, (n_samples, 1)) + rng.integers(-1, 2, (n_samples, n_cols))
+        values[rng.random(values.shape) < 0.02] = -1
+    elif pheno_type == "continuous":
+        values = (rng.lognormal(1.5, 0.5, (n_samples, 1)) + rng.normal(0, 0.2, (n_samples, n_cols))).round(3)
+    elif pheno_type == "categorical_single":
+        values = np.repeat(rng.choice(codes, (n_samples, 1)), n_cols, axis=1)
+        changed = rng.random(values.shape) < 0.05
+        values[changed] = rng.choice(np.r_[codes, list(NEGATIVE_CODES)], changed.sum())
+    else:
+        values = rng.choice(np.r_[codes, NONE_OF_THE_ABOVE_CODE, -3], (n_samples, n_cols))
+    values = values.astype(np.float64)
+    values[rng.random(values.shape) < missing_fraction] = np.nan
+    return values
+
+
+def get_field_specs(rng, n_fields, max_instances, max_arrays):
+    """
+    Returns the type, category, id, ordinality, number of instances, arrays and codes of every field
+    """
+    field_types = rng.choice(list(FIELD_TYPE_FRACTIONS), n_fields, p=list(FIELD_TYPE_FRACTIONS.values()))
+    field_specs = []
+    for field_idx, pheno_type in enumerate(field_types):
+        pheno_cat = f"{pheno_type}_group_{field_idx // FIELDS_PER_CATEGORY}"
+        n_instances = int(rng.integers(1, max_instances + 1))
+        n_arrays = int(rng.integers(2, max_arrays + 1)) if pheno_type == "categorical_multiple" else 1
+        n_codes = int(rng.integers(2, 12)) if pheno_type.startswith("categorical") else 0
+        pheno_ordinal = np.nan
+        if pheno_type == "categorical_single":
+            # mostly ordinal fields, a few one hot encoded ones and a few with both kinds of codes
+            pheno_ordinal = [np.nan, "O", "B"][rng.choice(3, p=[0.7, 0.2, 0.1])]
+            n_codes = max(n_codes, 3) if pheno_ordinal == "B" else n_codes
+        field_specs.append((pheno_type, pheno_cat, FIRST_FIELD_ID + field_idx, pheno_ordinal, n_instances, n_arrays, n_codes))
+    return field_specs
+
+
+def write_field_table(pheno_info_root, pheno_type, pheno_cat, pheno_id, eids, values, n_instances, n_arrays):
+    pheno_table_path = ut.get_pheno_table_filepath(pheno_info_root, pheno_type, pheno_cat, pheno_id, check_exists=False)
+    os.makedirs(os.path.dirname(pheno_table_path), exist_ok=True)
+    field_df = pd.DataFrame(values, index=pd.Index(eids, name="eid"), columns=get_field_columns(pheno_id, n_instances, n_arrays))
+    # like the UKB tables, samples without any value of the field are not listed and codes are written as integers
+    field_df.dropna(how="all").to_csv(pheno_table_path, float_format="%.10g")
+    return
+
+
+def write_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return
+
+
+def main(out_root, n_samples, n_fields, exome_fraction, max_instances, max_arrays, missing_fraction, seed):
+    rng = np.random.default_rng(seed)
+    pheno_info_root = os.path.join(out_root, "pheno_info_root")
+    pheno_storage_root = os.path.join(out_root, "pheno_storage_root")
+    eids = np.arange(1000000, 1000000 + n_samples)
+
+    field_specs = get_field_specs(rng, n_fields, max_instances, max_arrays)
+    category_encodings = {}
+    modified_encodings = {"ohe": {}, "ordinal": {}}
+    for pheno_type, pheno_cat, pheno_id, pheno_ordinal, n_instances, n_arrays, n_codes in field_specs:
+        values = make_field_values(rng, pheno_type, n_samples, n_instances * n_arrays, n_codes, missing_fraction)
+        write_field_table(pheno_info_root, pheno_type, pheno_cat, pheno_id, eids, values, n_instances, n_arrays)
+        # the encodings of all fields of a type and category are stored in one json file
+        field_encodings = "none"
+        if pheno_type == "categorical_single":
+            field_encodings = get_field_encodings(n_codes, NEGATIVE_CODES)
+        elif pheno_type == "categorical_multiple":
+            field_encodings = get_field_encodings(n_codes, {NONE_OF_THE_ABOVE_CODE: "None of the above", -3: "Prefer not to answer"})
+        category_encodings.setdefault((pheno_type, pheno_cat), {})[str(pheno_id)] = field_encodings
+        if pheno_ordinal == "B":
+            # the last code is not ordered with the rest, for e.g. I am not employed
+            modified_encodings["ohe"][str(pheno_id)] = {str(n_codes): field_encodings[str(n_codes)]}
+            modified_encodings["ordinal"][str(pheno_id)] = {str(code): field_encodings[str(code)] for code in range(1, n_codes)}
+
+    for (pheno_type, pheno_cat), encodings in category_encodings.items():
+        write_json(encodings, ut.get_pheno_encoding_filepath(pheno_info_root, pheno_type, pheno_cat, check_exists=False))
+    for enc_type, encodings in modified_encodings.items():
+        write_json(encodings, ut.get_modified_pheno_encoding_filepath(pheno_storage_root, enc_type, check_exists=False))
+
+    # phenos of interest file with all fields shortlisted
+    phenos_of_interest_df = pd.DataFrame(
+        [spec[:4] for spec in field_specs],
+        columns=["Type", "Phenotype_group", "Phenotype_ID", "not_ordinal"]
+        )
+    phenos_of_interest_df["shortlist"] = "X"
+    # the count always passes the minimum exome samples of the shortlist, so every field is kept for small runs too
+    phenos_of_interest_df["Num_exome_samples_with_phenotype"] = max(int(n_samples * exome_fraction), PHENOS_OF_INTEREST_MIN_SAMPLES)
+    phenos_of_interest_df.to_excel(os.path.join(out_root, "phenos_of_interest.xlsx"), index=False)
+
+    # ukb48799 style sample to exome vcf file, samples without exome data have empty columns
+    exome_df = pd.DataFrame(
+        {"23157-0.0": [f"/exomes/{e}_23157_0_0.vcf.gz" for e in eids], "23158-0.0": [f"/exomes/{e}_23157_0_0.vcf.gz.tbi" for e in eids]},
+        index=pd.Index(eids, name="eid")
+        )
+    exome_df.loc[rng.random(n_samples) >= exome_fraction] = np.nan
+    exome_df.to_csv(os.path.join(out_root, "ukb48799.csv"))
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=FILE_OBJECTIVE)
+    parser.add_argument(
+        "out_root",
+        type=str,
+        help="""The folder where pheno_info_root, pheno_storage_root (with the modified field encodings),
+        phenos_of_interest.xlsx and ukb48799.csv will be written"""
+        )
+    parser.add_argument("--n_samples", type=int, help="The number of samples", default=500000)
+    parser.add_argument("--n_fields", type=int, help="The number of fields, split among the field types", default=1000)
+    parser.add_argument("--exome_fraction", type=float, help="The fraction of samples with exome data", default=0.4)
+    parser.add_argument("--max_instances", type=int, help="The maximum number of instances of a field", default=4)
+    parser.add_argument("--max_arrays", type=int, help="The maximum number of arrays of a categorical multiple field", default=6)
+    parser.add_argument("--missing_fraction", type=float, help="The fraction of missing field values", default=0.3)
+    parser.add_argument("--seed", type=int, help="The seed of the random generator", default=0)
+
+    args = parser.parse_args()
+
+    main(
+        args.out_root,
+        args.n_samples,
+        args.n_fields,
+        args.exome_fraction,
+        args.max_instances,
+        args.max_arrays,
+        args.missing_fraction,
+        args.seed
+        )
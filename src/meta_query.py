@@ -0,0 +1,96 @@
+import re
+import numpy as np
+import pandas as pd
+import meta_store as ms
+
+
+# the meta table columns are named Input_{field id}_{code}
+def get_column_field_ids(columns):
+    return pd.Index(columns).str.split("_").str[1]
+
+
+class MetaTable:
+    """
+    Lazily loaded view of a packed meta table store written by 1_prepare_meta.py
+    with --meta_format bitpacked. Only the sample ids and the column info are read
+    when opened, the blocks are memory mapped on first use and only the bytes of the
+    selected rows and columns are unpacked
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = ms.read_store_index(store_dir)
+        self.columns = ms.read_store_columns(store_dir).set_index("new")
+        self._eids = self.index.to_numpy()
+        self._eids_order = ms.read_store_index_order(store_dir)
+        self._eids_sorted = self._eids[self._eids_order]
+        self._blocks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_block(self, block):
+        """
+        Returns the memory mapped packed codes of a block with shape (columns, ceil(rows/4)),
+        no data is read until the returned array is accessed
+        """
+        if block not in self._blocks:
+            self._blocks[block] = ms.read_block(self.store_dir, block)
+        return self._blocks[block]
+
+    def select_columns(self, field_ids=None, pattern=None):
+        """
+        Returns the meta table column names of the given field ids and/or the columns
+        whose new or old name matches the regex pattern, in meta table order
+        """
+        selected = np.ones(len(self.columns), dtype=bool)
+        if field_ids is not None:
+            selected &= get_column_field_ids(self.columns.index).isin([str(f) for f in field_ids])
+        if pattern is not None:
+            matches = re.compile(pattern).search
+            selected &= np.array([
+                bool(matches(new) or matches(old)) for new, old in zip(self.columns.index, self.columns.old)
+                ], dtype=bool)
+        return self.columns.index[selected].to_list()
+
+    def get_row_positions(self, eids):
+        """
+        Returns the meta table row positions of the sample ids through the sorted sample id index
+        """
+        eids = np.asarray(eids, dtype=np.int64)
+        eids_pos = np.searchsorted(self._eids_sorted, eids).clip(max=len(self._eids_sorted) - 1)
+        eids_hit = self._eids_sorted[eids_pos] == eids
+        if not eids_hit.all():
+            raise KeyError(f"{(~eids_hit).sum()} sample ids are not in the meta table, for e.g. {eids[~eids_hit][:5].tolist()}")
+        return self._eids_order[eids_pos]
+
+    def get_codes(self, columns, eids=None):
+        """
+        Returns the 2-bit cell codes (0, 1 or ms.MISSING_CODE) of the columns as an uint8 array with
+        shape (rows, columns) for all samples or the given sample ids, in the order they are given
+        """
+        column_info = self.columns.loc[list(columns)]
+        row_pos = np.arange(len(self.index)) if eids is None else self.get_row_positions(eids)
+        byte_pos = row_pos // ms.CELLS_PER_BYTE
+        shifts = ms.CODE_SHIFTS[row_pos % ms.CELLS_PER_BYTE]
+        codes = np.empty((len(row_pos), len(column_info)), dtype=np.uint8)
+        for col_pos, (block, offset) in enumerate(zip(column_info.block, column_info.offset)):
+            # a single column of a packed block is a contiguous view of its bytes
+            packed_col = self.get_block(block)[offset]
+            codes[:, col_pos] = (packed_col[byte_pos] >> shifts) & 3
+        return codes
+
+    def to_frame(self, columns=None, field_ids=None, pattern=None, eids=None):
+        """
+        Loads the selected columns and rows as a float dataframe with NaNs for missing
+        cells, same as reading them from meta_pheno_table3.csv
+        """
+        if columns is None:
+            columns = self.select_columns(field_ids, pattern)
+        codes = self.get_codes(columns, eids)
+        row_index = self.index if eids is None else pd.Index(np.asarray(eids, dtype=np.int64), name=self.index.name)
+        return pd.DataFrame(ms.decode_cells(codes), index=row_index, columns=list(columns))
+
+
+def open_meta_table(pheno_storage_root, name="meta_pheno_table3"):
+    return MetaTable(ms.get_meta_store_dir(pheno_storage_root, name))
@@ -0,0 +1,359 @@
+import os
+import json
+import shutil
+import pandas as pd
+import numpy as np
+import utils as ut
+
+
+##########################################
+# 2-bit packing of meta table cell codes #
+##########################################
+
+# every cell of the meta table is 0, 1 or missing (sample without the field value)
+# which are stored as 2-bit codes, four cells per byte
+MISSING_CODE = 2
+CELLS_PER_BYTE = 4
+CODE_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+
+def encode_cells(values):
+    """
+    Converts a float array of 0/1/NaN cells into an uint8 array of 2-bit codes
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    if not np.isin(values[~missing], [0, 1]).all():
+        raise ValueError("Meta table cells can only be 0, 1 or missing")
+    codes = values.astype(np.uint8, copy=False) if not missing.any() else np.where(missing, MISSING_CODE, values).astype(np.uint8)
+    return codes
+
+
+def decode_cells(codes):
+    """
+    Converts an uint8 array of 2-bit codes back to a float array of 0/1/NaN cells
+    """
+    values = codes.astype(np.float64)
+    values[codes == MISSING_CODE] = np.nan
+    return values
+
+
+def pack_codes(codes):
+    """
+    Packs a 2d array of codes with shape (columns, rows) into a column major
+    uint8 array with shape (columns, ceil(rows/4)) so that each column can be
+    addressed on its own
+    """
+    n_cols, n_rows = codes.shape
+    n_pad = (-n_rows) % CELLS_PER_BYTE
+    codes = np.pad(codes, ((0, 0), (0, n_pad))).reshape(n_cols, -1, CELLS_PER_BYTE)
+    packed = np.bitwise_or.reduce(codes << CODE_SHIFTS, axis=2).astype(np.uint8)
+    return packed
+
+
+def unpack_codes(packed, n_rows):
+    """
+    Reverses pack_codes, returns the codes with shape (columns, rows)
+    """
+    codes = (packed[:, :, None] >> CODE_SHIFTS) & 3
+    return codes.reshape(packed.shape[0], -1)[:, :n_rows]
+
+
+##########################
+# meta table block store #
+##########################
+
+# the store is a directory with
+# 1) store.json: the number of rows and the name of the row index
+# 2) eids.npy: the sample ids of the rows in meta table order
+#    eids_order.npy: the row positions that sort the sample ids, used to look up rows by sample id
+# 3) columns.csv: the old and new column names in meta table order along with the
+#    block each column is stored in and its position within the block
+# 4) blocks/{block}.npy: the packed codes of the columns of one field
+
+def get_meta_store_dir(pheno_storage_root, name="meta_pheno_table3"):
+    return os.path.join(pheno_storage_root, name)
+
+
+def get_block_path(store_dir, block):
+    return os.path.join(store_dir, "blocks", f"{block}.npy")
+
+
+def write_store_index(store_dir, row_index):
+    os.makedirs(os.path.join(store_dir, "blocks"), exist_ok=True)
+    eids = row_index.to_numpy(dtype=np.int64)
+    np.save(os.path.join(store_dir, "eids.npy"), eids)
+    np.save(os.path.join(store_dir, "eids_order.npy"), np.argsort(eids, kind="stable"))
+    with open(os.path.join(store_dir, "store.json"), "w") as f:
+        json.dump({"n_rows": len(row_index), "index_name": row_index.name}, f)
+    return
+
+
+def write_block(store_dir, block, pheno_df, col_df):
+    """
+    Packs the reindexed meta table columns of a field into a block, and returns
+    the column info of the block with the old and new column names in the
+    order of the meta table columns
+    """
+    assert len(pheno_df) == read_store_info(store_dir)["n_rows"]
+    codes = encode_cells(pheno_df.to_numpy(dtype=np.float64).T)
+    np.save(get_block_path(store_dir, block), pack_codes(codes))
+    block_col_df = col_df.set_index("new").loc[list(pheno_df.columns)].reset_index()
+    block_col_df = block_col_df.loc[:, ["old", "new"]].assign(
+        block=str(block),
+        offset=np.arange(len(col_df)),
+        has_missing=bool((codes == MISSING_CODE).any())
+        )
+    return block_col_df
+
+
+STORE_COLUMNS = ["old", "new", "block", "offset", "has_missing"]
+
+
+def write_store_columns(store_dir, block_col_dfs):
+    store_col_df = pd.concat(block_col_dfs, axis=0, ignore_index=True) if block_col_dfs else pd.DataFrame(columns=STORE_COLUMNS)
+    store_col_df.to_csv(os.path.join(store_dir, "columns.csv"), index=False)
+    return store_col_df
+
+
+def read_store_info(store_dir):
+    with open(os.path.join(store_dir, "store.json"), "r") as f:
+        store_info = json.load(f)
+    return store_info
+
+
+def read_store_index(store_dir):
+    store_info = read_store_info(store_dir)
+    eids = np.load(os.path.join(store_dir, "eids.npy"))
+    return pd.Index(eids, name=store_info["index_name"])
+
+
+def read_store_index_order(store_dir):
+    """
+    Returns the row positions that sort the sample ids of the store, computed from 
+    the sample ids for stores written without them
+    """
+    order_path = os.path.join(store_dir, "eids_order.npy")
+    if os.path.exists(order_path):
+        return np.load(order_path)
+    return np.argsort(np.load(os.path.join(store_dir, "eids.npy")), kind="stable")
+
+
+def read_store_columns(store_dir):
+    return pd.read_csv(os.path.join(store_dir, "columns.csv"), dtype={"block": str})
+
+
+def read_block(store_dir, block, mmap_mode="r"):
+    return np.load(get_block_path(store_dir, block), mmap_mode=mmap_mode)
+
+
+def iter_store_blocks(store_col_df):
+    """
+    Yields the column info of each run of consecutive columns stored in the same block
+    """
+    block_runs = (store_col_df.block != store_col_df.block.shift()).cumsum()
+    for _, block_col_df in store_col_df.groupby(block_runs, sort=False):
+        yield block_col_df.block.iloc[0], block_col_df
+
+
+def load_meta_table(store_dir):
+    """
+    Loads the full meta table from a store as a float dataframe with NaNs for
+    missing cells, same as the csv meta table
+    """
+    row_index = read_store_index(store_dir)
+    store_col_df = read_store_columns(store_dir)
+    block_dfs = []
+    for block, block_col_df in iter_store_blocks(store_col_df):
+        codes = unpack_codes(read_block(store_dir, block), len(row_index))
+        values = decode_cells(codes[block_col_df.offset.to_numpy()].T)
+        block_dfs.append(pd.DataFrame(values, index=row_index, columns=block_col_df.new.to_list()))
+    return pd.concat(block_dfs, axis=1)
+
+
+def get_csv_chunk_rows(n_cols, memory_budget_mb, bytes_per_cell=24):
+    """
+    Returns the number of meta table rows that can be formatted at once within the
+    memory budget, counting the unpacked codes, the float cells and their text
+    """
+    chunk_rows = int(memory_budget_mb * 1024 ** 2 // max(n_cols * bytes_per_cell, 1))
+    # chunks start at a byte boundary of the packed columns
+    return max(chunk_rows - chunk_rows % CELLS_PER_BYTE, CELLS_PER_BYTE)
+
+
+def write_meta_csv(store_dir, meta_csv_path, memory_budget_mb=1024):
+    """
+    Writes the meta table of a store as csv in chunks of rows, so that the memory
+    used is bounded by the budget instead of the size of the meta table.
+    The csv is the same as the one written from the in-memory meta table; blocks 
+    of fields without missing cells are written as integers and the rest as floats
+    """
+    row_index = read_store_index(store_dir)
+    store_col_df = read_store_columns(store_dir)
+    store_blocks = list(iter_store_blocks(store_col_df))
+    chunk_rows = get_csv_chunk_rows(len(store_col_df), memory_budget_mb)
+    for chunk_start in range(0, len(row_index), chunk_rows):
+        chunk_end = min(chunk_start + chunk_rows, len(row_index))
+        chunk_dfs = []
+        for block, block_col_df in store_blocks:
+            packed = read_block(store_dir, block)[:, chunk_start // CELLS_PER_BYTE:-(-chunk_end // CELLS_PER_BYTE)]
+            codes = unpack_codes(packed, chunk_end - chunk_start)[block_col_df.offset.to_numpy()].T
+            values = decode_cells(codes) if block_col_df.has_missing.iloc[0] else codes
+            chunk_dfs.append(pd.DataFrame(values, index=row_index[chunk_start:chunk_end], columns=block_col_df.new.to_list()))
+        chunk_df = pd.concat(chunk_dfs, axis=1)
+        chunk_df.to_csv(meta_csv_path, mode="w" if chunk_start == 0 else "a", header=chunk_start == 0)
+    return
+
+
+#############################
+# incremental store updates #
+#############################
+
+# a store built in update mode also keeps
+# 1) build_manifest.json: the hash of the sample ids and the inputs of every field of the last build
+# 2) meta_columns.csv: the old and new column names of meta_pheno_table_cols3.csv with the block of their field
+# so that only the fields added, removed or changed since the last build are formatted again
+
+def read_build_manifest(store_dir):
+    manifest_path = os.path.join(store_dir, "build_manifest.json")
+    if not os.path.exists(manifest_path):
+        return {"eids": None, "fields": {}}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def write_build_manifest(store_dir, build_manifest):
+    manifest_path = os.path.join(store_dir, "build_manifest.json")
+    ut.write_json_atomic(manifest_path, build_manifest, indent=1, sort_keys=True)
+    return
+
+
+def read_field_columns(store_dir):
+    """
+    Returns the meta columns and store columns of every field of a store built in update mode,
+    keyed by the block of the field
+    """
+    if not os.path.exists(os.path.join(store_dir, "meta_columns.csv")):
+        return {}
+    meta_col_df = pd.read_csv(os.path.join(store_dir, "meta_columns.csv"), dtype={"block": str})
+    store_col_df = read_store_columns(store_dir)
+    return {
+        block: (block_meta_col_df.loc[:, ["old", "new"]], store_col_df.loc[store_col_df.block == block, STORE_COLUMNS])
+        for block, block_meta_col_df in meta_col_df.groupby("block", sort=False)
+        }
+
+
+def write_field_columns(store_dir, field_cols):
+    """
+    Writes the store columns and the meta columns of a store built in update mode,
+    field_cols is a list of (block, meta columns, store columns) in meta table order
+    """
+    write_store_columns(store_dir, [block_col_df for _, _, block_col_df in field_cols])
+    meta_col_dfs = [meta_col_df.assign(block=str(block)) for block, meta_col_df, _ in field_cols]
+    meta_col_df = pd.concat(meta_col_dfs, axis=0) if meta_col_dfs else pd.DataFrame(columns=["old", "new", "block"])
+    meta_col_df.to_csv(os.path.join(store_dir, "meta_columns.csv"), index=False)
+    return
+
+
+def check_field_columns(store_dir, block, meta_col_df, block_col_df):
+    """
+    Returns whether the stored columns of a field can be reused, which needs its block
+    and store columns that are the same as its meta columns
+    """
+    if block_col_df.empty or set(block_col_df.new) != set(meta_col_df.new):
+        return False
+    return os.path.exists(get_block_path(store_dir, block))
+
+
+def remove_block(store_dir, block):
+    block_path = get_block_path(store_dir, block)
+    if os.path.exists(block_path):
+        os.remove(block_path)
+    return
+
+
+#######################
+# sharded meta stores #
+#######################
+
+# a sharded meta stage writes one store per shard with the fields of the shard, along with
+# 1) shard.json: the shard index and the number of shards
+# 2) columns.csv: the store columns with the position of their field in the phenos of interest file
+# 3) meta_columns.csv: the old and new column names of meta_pheno_table_cols3.csv with the position of their field
+# the shard stores are merged into the final meta outputs in the order of the field positions
+
+def get_shard_store_dir(pheno_storage_root, shard, name="meta_pheno_table3"):
+    shard_idx, n_shards = shard
+    return get_meta_store_dir(pheno_storage_root, f"{name}.shard{shard_idx}of{n_shards}")
+
+
+def write_shard_columns(store_dir, shard, field_cols):
+    """
+    Writes the column maps of a shard store, field_cols maps the position of every
+    field of the shard to its (meta columns, store columns)
+    """
+    positions = sorted(field_cols)
+    store_col_dfs = [field_cols[position][1].assign(position=position) for position in positions]
+    write_store_columns(store_dir, store_col_dfs)
+    meta_col_dfs = [field_cols[position][0].assign(position=position) for position in positions]
+    meta_col_df = pd.concat(meta_col_dfs, axis=0) if meta_col_dfs else pd.DataFrame(columns=["old", "new", "position"])
+    meta_col_df.to_csv(os.path.join(store_dir, "meta_columns.csv"), index=False)
+    with open(os.path.join(store_dir, "shard.json"), "w") as f:
+        json.dump({"shard": shard[0], "n_shards": shard[1]}, f)
+    return
+
+
+def read_shard_store(store_dir):
+    with open(os.path.join(store_dir, "shard.json"), "r") as f:
+        shard_info = json.load(f)
+    meta_col_df = pd.read_csv(os.path.join(store_dir, "meta_columns.csv"))
+    return shard_info, read_store_columns(store_dir), meta_col_df
+
+
+def validate_shard_stores(shard_dirs, n_shards):
+    """
+    Checks that the shard stores are the N shards of one run with the same rows, that every
+    field is in exactly one shard and that the meta columns of every field match its store columns.
+    Returns the row index along with the store and meta columns of all shards
+    """
+    for shard_idx, shard_dir in enumerate(shard_dirs, start=1):
+        if not os.path.exists(os.path.join(shard_dir, "shard.json")):
+            raise ValueError(f"Shard {shard_idx}/{n_shards} is missing or incomplete: {shard_dir}")
+    row_index = read_store_index(shard_dirs[0])
+    store_col_dfs, meta_col_dfs = [], []
+    for shard_idx, shard_dir in enumerate(shard_dirs, start=1):
+        shard_info, store_col_df, meta_col_df = read_shard_store(shard_dir)
+        if (shard_info["shard"], shard_info["n_shards"]) != (shard_idx, n_shards):
+            raise ValueError(f"{shard_dir} is shard {shard_info['shard']}/{shard_info['n_shards']} instead of {shard_idx}/{n_shards}")
+        if not read_store_index(shard_dir).equals(row_index):
+            raise ValueError(f"The rows of shard {shard_idx}/{n_shards} differ from the rows of shard 1/{n_shards}")
+        store_col_dfs.append(store_col_df.assign(shard_dir=shard_dir))
+        meta_col_dfs.append(meta_col_df)
+    store_col_df = pd.concat(store_col_dfs, axis=0, ignore_index=True)
+    meta_col_df = pd.concat(meta_col_dfs, axis=0, ignore_index=True)
+
+    if store_col_df.groupby("position").block.nunique().gt(1).any() or store_col_df.groupby("block").position.nunique().gt(1).any():
+        raise ValueError("A field is stored in more than one shard")
+    if store_col_df.new.duplicated().any():
+        raise ValueError(f"Duplicated meta table columns: {store_col_df.new[store_col_df.new.duplicated()].unique().tolist()}")
+    store_cols = store_col_df.groupby("position").new.apply(frozenset)
+    meta_cols = meta_col_df.groupby("position").new.apply(frozenset)
+    if not store_cols.equals(meta_cols):
+        raise ValueError("The meta columns of the shards do not match their stored columns")
+    return row_index, store_col_df, meta_col_df
+
+
+def merge_shard_stores(store_dir, row_index, store_col_df, meta_col_df):
+    """
+    Merges the shard stores validated by validate_shard_stores into a single store with the fields 
+    in the order of their positions, same as the store of an unsharded run, and returns the meta 
+    columns in that order
+    """
+    write_store_index(store_dir, row_index)
+    for block, shard_dir in store_col_df.groupby("block").shard_dir.first().items():
+        shutil.copyfile(get_block_path(shard_dir, block), get_block_path(store_dir, block))
+    # stable sorts keep the columns of every field in their stored order
+    store_col_df = store_col_df.sort_values("position", kind="stable")
+    write_store_columns(store_dir, [store_col_df.loc[:, STORE_COLUMNS]])
+    meta_col_df = meta_col_df.sort_values("position", kind="stable").drop(columns="position")
+    return meta_col_df
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+FILE_OBJECTIVE = """Split the UKB main dataset into per field tables of the phenotypes of interest in a single pass"""
+
+import argparse
+import os
+import pandas as pd
+import utils as ut
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_field_columns(main_dataset_columns, pheno_ids):
+    """
+    Maps each field id to its <field>-<instance>.<array> columns in the main dataset
+    """
+    field_columns = {str(pheno_id): [] for pheno_id in pheno_ids}
+    for col in main_dataset_columns:
+        field_id = col.split("-")[0]
+        if field_id in field_columns:
+            field_columns[field_id].append(col)
+    return field_columns
+
+
+def write_field_chunk(main_dataset_chunk, field_columns, pheno_table_path, first_chunk):
+    """
+    Appends the samples with any value of a field in the chunk to the field's table
+    """
+    field_chunk = main_dataset_chunk.loc[:, field_columns].dropna(how="all")
+    field_chunk.to_csv(pheno_table_path, mode="w" if first_chunk else "a", header=first_chunk)
+    return
+
+
+def main(phenos_of_interest_file, main_dataset_file, pheno_info_root, chunksize, writers):
+
+    # read phenos of interest df
+    phenos_of_interest_df = ut.read_phenos_of_interest_data(phenos_of_interest_file)
+    # only the header of the main dataset is read to find the columns of every field
+    main_dataset_columns = list(pd.read_csv(main_dataset_file, nrows=0).columns)
+    eid_column = main_dataset_columns[0]
+    field_columns = get_field_columns(main_dataset_columns[1:], phenos_of_interest_df.Phenotype_ID)
+
+    field_tables = []
+    for t, c, i in zip(phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group, phenos_of_interest_df.Phenotype_ID):
+        if not field_columns[str(i)]:
+            print(f"Warning:: field id {i} is not present in the main dataset")
+            continue
+        pheno_table_path = ut.get_pheno_table_filepath(pheno_info_root, t, c, i, check_exists=False)
+        os.makedirs(os.path.dirname(pheno_table_path), exist_ok=True)
+        field_tables.append((field_columns[str(i)], pheno_table_path))
+    usecols = [eid_column] + [col for cols, _ in field_tables for col in cols]
+
+    # the main dataset is streamed once in chunks of rows, each chunk is routed to the field
+    # tables by parallel writers while the next chunk is parsed, so at most two chunks are in memory
+    main_dataset_reader = pd.read_csv(main_dataset_file, usecols=usecols, index_col=eid_column, chunksize=chunksize)
+    with ThreadPoolExecutor(writers) as executor:
+        pending_writes = []
+        for chunk_idx, main_dataset_chunk in enumerate(main_dataset_reader):
+            for pending_write in pending_writes:
+                pending_write.result()
+            pending_writes = [
+                executor.submit(write_field_chunk, main_dataset_chunk, cols, path, chunk_idx == 0)
+                for cols, path in field_tables
+                ]
+        for pending_write in pending_writes:
+            pending_write.result()
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=FILE_OBJECTIVE)
+    parser.add_argument(
+        "phenos_of_interest_file",
+        type=str,
+        help="""The file path of the manually prepared excel file that contains information about
+        the phenotypes' type (column name: Type), category (column name: Phenotype_group) and
+        field id: (column name: Phenotype_ID), field ordinality (column name: not_ordinal)"""
+        )
+    parser.add_argument(
+        "main_dataset_file",
+        type=str,
+        help="""The file path of the UKB main dataset csv file with an eid column followed by
+        <field>-<instance>.<array> columns"""
+        )
+    parser.add_argument("pheno_info_root", type=str, help="The folder where the per field tables will be stored under type -> category -> tables")
+    parser.add_argument("-c", "--chunksize", type=int, help="The number of rows of the main dataset parsed at a time", default=ut.PHENO_TABLE_CHUNKSIZE)
+    parser.add_argument("-w", "--writers", type=int, help="The number of threads writing per field tables", default=8)
+
+    args = parser.parse_args()
+
+    main(
+        args.phenos_of_interest_file,
+        args.main_dataset_file,
+        args.pheno_info_root,
+        args.chunksize,
+        args.writers
+        )
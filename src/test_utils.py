@@ -0,0 +1,140 @@
+import os
+import signal
+import numpy as np
+import pandas as pd
+import pytest
+import utils as ut
+
+
+def merge_values_categorical_reference(pheno_df):
+    """
+    The bfill/nunique/zip consensus merge that get_consensus_values replaced
+    """
+    pheno_df_nona = pheno_df.bfill(axis=1).iloc[:,0]
+    pheno_df_consistent = pheno_df.nunique(axis=1)==1
+    pheno_df_consensus = pd.Series([i if j==True else np.nan for i,j in zip(pheno_df_nona, pheno_df_consistent)])
+    pheno_df = pheno_df.copy()
+    pheno_df["merged"] = pheno_df_consensus.values
+    return pheno_df.dropna(subset=["merged"])
+
+
+def make_field_values(rng, n_rows, n_cols):
+    # categorical codes along with negative codes and missing values
+    codes = np.array([1, 2, 3, -1, -3, np.nan])
+    return rng.choice(codes, (n_rows, n_cols), p=[0.4, 0.1, 0.1, 0.1, 0.1, 0.2])
+
+
+@pytest.mark.parametrize("n_cols", [1, 2, 3, 4])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_consensus_values_match_reference(seed, n_cols):
+    rng = np.random.default_rng(seed)
+    values = make_field_values(rng, 2000, n_cols)
+    pheno_df = pd.DataFrame(values, index=pd.Index(np.arange(len(values)) + 1000000, name="eid"))
+    expected = merge_values_categorical_reference(pheno_df)
+    merged = ut.merge_values_categorical(pheno_df.copy(), "categorical_single")
+    pd.testing.assert_frame_equal(merged, expected)
+
+
+def test_consensus_values_of_rows():
+    values = np.array([
+        [1, 1, np.nan],
+        [np.nan, 2, 2],
+        [1, 2, np.nan],
+        [np.nan, np.nan, np.nan],
+        [-1, -1, -1],
+        [-3, np.nan, 3],
+        ])
+    merged = ut.get_consensus_values(values)
+    np.testing.assert_array_equal(merged, [1, 2, np.nan, np.nan, -1, np.nan])
+
+
+@pytest.mark.parametrize("dtype", ["int8", "int16", "int64"])
+def test_consensus_keeps_integer_codes(dtype):
+    # single instance fields always reach a consensus and keep integer codes
+    pheno_df = pd.DataFrame({"100-0.0": np.array([1, 2, 3, -1], dtype=dtype)})
+    expected = merge_values_categorical_reference(pheno_df)
+    merged = ut.merge_values_categorical(pheno_df.copy(), "categorical_single")
+    pd.testing.assert_frame_equal(merged, expected)
+    assert merged["merged"].dtype == np.int64
+
+
+def test_consensus_without_agreement_is_float():
+    pheno_df = pd.DataFrame({"100-0.0": np.array([1, 2], dtype="int8"), "100-1.0": np.array([1, 3], dtype="int8")})
+    expected = merge_values_categorical_reference(pheno_df)
+    merged = ut.merge_values_categorical(pheno_df.copy(), "categorical_single")
+    pd.testing.assert_frame_equal(merged, expected)
+    assert merged["merged"].dtype == np.float64
+
+
+@pytest.mark.parametrize("n_values", [0, 1, 2, 3, 10, 1001])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_sorted_quantiles_match_numpy(seed, n_values):
+    rng = np.random.default_rng(seed)
+    # rounded values give ties, negative values and zeros, without the signed zeros
+    # which np.quantile may reorder when partitioning
+    values_sorted = np.sort(np.round(rng.normal(0, 10, n_values), 1)) + 0.0
+    quantiles = [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]
+    expected = np.quantile(values_sorted, quantiles) if n_values else np.full(len(quantiles), np.nan)
+    np.testing.assert_array_equal(ut.get_sorted_quantiles(values_sorted, quantiles), expected)
+    expected_median = np.median(values_sorted) if n_values else np.nan
+    np.testing.assert_array_equal(ut.get_sorted_median(values_sorted), expected_median)
+    assert [str(q) for q in ut.get_sorted_quantiles(values_sorted, quantiles)] == [str(q) for q in expected]
+
+
+def test_write_json_atomic(tmp_path):
+    json_path = tmp_path / "manifest.json"
+    ut.write_json_atomic(str(json_path), {"b": 1, "a": [1, 2]}, indent=1, sort_keys=True)
+    ut.write_json_atomic(str(json_path), {"c": 3}, indent=1, sort_keys=True)
+    assert json_path.read_text() == '{\n "c": 3\n}'
+    # the temporary file is gone and the file has the usual permissions, not those of mkstemp
+    assert [p.name for p in tmp_path.iterdir()] == ["manifest.json"]
+    assert json_path.stat().st_mode & 0o777 == 0o666 & ~current_umask()
+
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@pytest.mark.skipif(not ut.reset_peak_rss(), reason="the peak memory cannot be reset")
+def test_field_report_peak_memory_is_per_field():
+    big_report = ut.FieldReport(1, "integer")
+    big_values = np.ones(400 * 2**20 // 8)
+    del big_values
+    big_peak = big_report.to_dict()["peak_rss_mb"]
+    small_report = ut.FieldReport(2, "integer")
+    small_peak = small_report.to_dict()["peak_rss_mb"]
+    assert big_peak - small_peak > 300
+    # the peak is not reset while another field is in flight
+    outer_report = ut.FieldReport(3, "integer")
+    big_values = np.ones(400 * 2**20 // 8)
+    del big_values
+    inner_report = ut.FieldReport(4, "integer")
+    assert inner_report.to_dict()["peak_rss_mb"] - small_peak > 300
+    assert outer_report.to_dict()["peak_rss_mb"] - small_peak > 300
+
+
+def run_or_kill_worker(value):
+    # a task that dies like a worker killed out of memory
+    if value < 0:
+        os.kill(os.getpid(), signal.SIGKILL)
+    if value == 0:
+        raise ValueError("zero")
+    return value * 2
+
+
+@pytest.mark.parametrize("n_workers", [1, 3])
+def test_tasks_survive_killed_workers(n_workers):
+    values = [5, -1, 3, 0, 8, -2, 1, 7, 2]
+    pool_iter = [(value,) for value in values]
+    costs = [abs(value) for value in values]
+    results = list(ut.imap_tasks_by_cost(run_or_kill_worker, pool_iter, costs, n_workers))
+    assert sorted(position for position, _, _ in results) == list(range(len(values)))
+    for position, result, error in results:
+        if values[position] < 0:
+            assert result is None and "worker process died" in error
+        elif values[position] == 0:
+            assert result is None and "ValueError" in error
+        else:
+            assert result == values[position] * 2 and error is None
@@ -1,5 +1,17 @@
 import os
 import json
+import time
+import heapq
+import hashlib
+import weakref
+import resource
+import tempfile
+import threading
+import functools
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
 
@@ -29,7 +41,7 @@ def read_exome_data(sample_to_exome_file):
     df = df.dropna(how="all").reset_index()
     return df
 
-def get_pheno_table_filepath(root_dir, pheno_type, pheno_cat, pheno_id):
+def get_pheno_table_filepath(root_dir, pheno_type, pheno_cat, pheno_id, check_exists=True):
     """
     This function accepts
     1) root_dir: where the sample to phenotype value table is stored under type -> category -> id hierarchy
@@ -42,19 +54,198 @@ def get_pheno_table_filepath(root_dir, pheno_type, pheno_cat, pheno_id):
     pheno_table_path = os.path.join(
         root_dir, pheno_type, pheno_cat, "tables", f"{pheno_id}.csv"
         )
-    assert os.path.exists(pheno_table_path)
+    if check_exists:
+        assert os.path.exists(pheno_table_path)
     return pheno_table_path
 
 
-def read_pheno_table(pheno_table_path):
-    df =  pd.read_csv(pheno_table_path, index_col=0)
+# number of rows of a raw field table that are parsed at full width at a time
+PHENO_TABLE_CHUNKSIZE = 50000
+
+
+def downcast_pheno_values(df):
+    """
+    Downcasts the field value columns of a raw field table to the most compact dtype
+    that keeps every value exact. Integer columns, such as categorical codes, are 
+    downcast to the smallest integer dtype and float columns to float32 if none 
+    of their values change, else they are kept as float64
+    """
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+        elif pd.api.types.is_float_dtype(df[col]) and df[col].dtype != np.float32:
+            col_values = df[col].to_numpy()
+            col_values32 = col_values.astype(np.float32)
+            if np.array_equal(col_values32, col_values, equal_nan=True):
+                df[col] = col_values32
     return df
 
 
+def read_pheno_table(pheno_table_path, chunksize=None, exome_eids=None):
+    """
+    Reads the raw sample to field value table. When a chunksize is given, the table is
+    parsed in chunks of rows that are downcast to compact dtypes one at a time, so that only 
+    one chunk is held at full width. When sorted exome eids are given, only the samples
+    with exome data are kept from each chunk
+    """
+    if not chunksize:
+        df =  pd.read_csv(pheno_table_path, index_col=0)
+        if exome_eids is not None:
+            df = df.loc[is_exome_sample(df.index, exome_eids)]
+        return df
+    df_chunks = []
+    for df_chunk in pd.read_csv(pheno_table_path, index_col=0, chunksize=chunksize):
+        if exome_eids is not None:
+            df_chunk = df_chunk.loc[is_exome_sample(df_chunk.index, exome_eids)]
+        df_chunks.append(downcast_pheno_values(df_chunk))
+    if not df_chunks:
+        return pd.read_csv(pheno_table_path, index_col=0, nrows=0)
+    df = pd.concat(df_chunks, axis=0)
+    return df
+
+
+############################
+# writing files atomically #
+############################
+
+def write_file_atomic(file_path, write_func, mode="w"):
+    """
+    Writes a file with write_func into a uniquely named temporary file in the same directory,
+    which then replaces the file atomically, so that concurrent writers or an interrupted run
+    never leave a partial file
+    """
+    file_fd, file_tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), prefix=f"{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file readable only by its owner, give it the usual permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        os.fchmod(file_fd, 0o666 & ~umask)
+        with os.fdopen(file_fd, mode) as f:
+            write_func(f)
+        os.replace(file_tmp_path, file_path)
+    finally:
+        if os.path.exists(file_tmp_path):
+            os.remove(file_tmp_path)
+    return
+
+
+def write_json_atomic(json_path, json_obj, **dump_kwargs):
+    write_file_atomic(json_path, lambda f: json.dump(json_obj, f, **dump_kwargs))
+    return
+
+
+#############################
+# cached exome sample index #
+#############################
+
+# the sample ids with exome data are cached as a compact npz file along with the hash,
+# size and modification time of the bulk file they were parsed from
+EXOME_FILE_CHUNKSIZE = 100000
+
+
+def get_exome_index_cache_path(cache_root_dir):
+    return os.path.join(cache_root_dir, "cache", "exome_index.npz")
+
+
+def build_exome_index(sample_to_exome_file, chunksize=EXOME_FILE_CHUNKSIZE):
+    """
+    Parses the sample to exome file in chunks of rows as plain strings and keeps only
+    the sample ids with any exome value, in the order of the file
+    """
+    exome_reader = pd.read_csv(sample_to_exome_file, index_col=0, dtype=str, chunksize=chunksize)
+    exome_eids, index_name = [], None
+    for exome_chunk in exome_reader:
+        index_name = exome_chunk.index.name
+        exome_eids.append(exome_chunk.index[exome_chunk.notna().any(axis=1)].to_numpy(dtype=np.int64))
+    exome_eids = np.concatenate(exome_eids) if exome_eids else np.array([], dtype=np.int64)
+    return pd.Index(exome_eids, name=index_name)
+
+
+def write_exome_index_cache(cache_path, exome_cache):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # concurrent jobs, possibly on different nodes, may write the cache at the same time
+    write_file_atomic(cache_path, lambda f: np.savez(f, **exome_cache), mode="wb")
+    return
+
+
+def read_exome_index_cache(sample_to_exome_file, cache_root_dir):
+    """
+    Returns the cached exome sample ids in file order and sorted, the cache is rebuilt
+    when the contents of the sample to exome file changed since it was built. The file
+    is only hashed again if its size or modification time changed, and the new ones are
+    cached when its contents did not
+    """
+    cache_path = get_exome_index_cache_path(cache_root_dir)
+    source_stat = os.stat(sample_to_exome_file)
+    source_hash = None
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            exome_cache = {key: cache[key] for key in cache.files}
+        if (exome_cache["source_size"], exome_cache["source_mtime"]) == (source_stat.st_size, source_stat.st_mtime_ns):
+            return exome_cache
+        source_hash = hash_file(sample_to_exome_file)
+        if str(exome_cache["source_hash"]) == source_hash:
+            exome_cache["source_size"] = np.array(source_stat.st_size)
+            exome_cache["source_mtime"] = np.array(source_stat.st_mtime_ns)
+            write_exome_index_cache(cache_path, exome_cache)
+            return exome_cache
+
+    exome_index = build_exome_index(sample_to_exome_file)
+    exome_cache = {
+        "eids": exome_index.to_numpy(dtype=np.int64),
+        "sorted_eids": np.unique(exome_index.to_numpy(dtype=np.int64)),
+        "index_name": np.array(exome_index.name or ""),
+        "source_hash": np.array(source_hash or hash_file(sample_to_exome_file)),
+        "source_size": np.array(source_stat.st_size),
+        "source_mtime": np.array(source_stat.st_mtime_ns),
+        }
+    write_exome_index_cache(cache_path, exome_cache)
+    return exome_cache
+
+
+def load_exome_index(sample_to_exome_file, cache_root_dir):
+    """
+    Returns the sample ids with exome data in the order of the sample to exome file,
+    same as get_exome_index, from the cache
+    """
+    exome_cache = read_exome_index_cache(sample_to_exome_file, cache_root_dir)
+    return pd.Index(exome_cache["eids"], name=str(exome_cache["index_name"]) or None)
+
+
+def load_exome_eids(sample_to_exome_file, cache_root_dir):
+    """
+    Returns the sorted unique sample ids with exome data as an int array from the cache,
+    a compact read-only structure that can be shared with pool workers
+    """
+    return read_exome_index_cache(sample_to_exome_file, cache_root_dir)["sorted_eids"]
+
+
 ##############################
 # filtering phenotype values #
 ##############################
 
+def get_valid_values_mask(values, pheno_type):
+    """
+    Returns the mask of the valid cells of a 2d float array of field values, which are the
+    non negative values and -7 (None of the above) for categorical multiple fields.
+    Null cells compare false so they are never valid
+    """
+    valid = values >= 0
+    if pheno_type in {"categorical_multiple"}:
+        np.logical_or(valid, values == -7, out=valid)
+    return valid
+
+
+def get_row_means(values, counted):
+    """
+    Returns the mean of the counted cells of each row of a 2d float array of field values,
+    NaN for rows without any counted cell
+    """
+    row_sums = np.where(counted, values, 0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return row_sums / counted.sum(axis=1)
+
+
 def filter_pheno_table_no_negs(pheno_df_all, pheno_type):
     """
     Filter all samples which have negative field values
@@ -62,10 +253,24 @@ def filter_pheno_table_no_negs(pheno_df_all, pheno_type):
     except in case of categorical multiple type of fields where -7 
     which denotes None of the above has a meaning 
     """
-    if pheno_type in {"categorical_multiple"}:
-        df = pheno_df_all.loc[(pheno_df_all==-7).any(axis=1)|(pheno_df_all>=0).any(axis=1)]
-    else:
-        df = pheno_df_all.loc[(pheno_df_all>=0).any(axis=1)]
+    # a single mask over the values instead of a boolean dataframe per condition
+    keep_rows = get_valid_values_mask(pheno_df_all.to_numpy(dtype=np.float64), pheno_type).any(axis=1)
+    df = pheno_df_all.loc[keep_rows]
+    return df
+
+
+def filter_merge_values_numerical(pheno_df_all, pheno_type, exclude_negatives=False):
+    """
+    Filters the samples without any non negative field value and merges the field values
+    of the rest by taking their mean, from one pass over the values. Same as 
+    filter_pheno_table_no_negs followed by merge_values_numerical
+    """
+    values = pheno_df_all.to_numpy(dtype=np.float64)
+    valid = get_valid_values_mask(values, pheno_type)
+    keep_rows = valid.any(axis=1)
+    row_means = get_row_means(values, valid if exclude_negatives else ~np.isnan(values))
+    df = pheno_df_all.loc[keep_rows]
+    df["merged"] = row_means[keep_rows]
     return df
 
 
@@ -85,21 +290,37 @@ def merge_values_categorical(pheno_df_no_negative_vals, pheno_type):
     into a consensus value. Therefore it is returned as is for downstream processing
     """
     if pheno_type == "categorical_single":
-        pheno_df_no_negative_vals_nona = pheno_df_no_negative_vals.fillna(method='bfill', axis=1).iloc[:,0]
-        pheno_df_no_negative_vals_consistent = pheno_df_no_negative_vals.nunique(axis=1)==1
-        pheno_df_no_negative_vals_consensus = pd.Series([i if j==True else np.nan for i,j in zip(pheno_df_no_negative_vals_nona, pheno_df_no_negative_vals_consistent)])
-        assert len(pheno_df_no_negative_vals) ==  len(pheno_df_no_negative_vals_consensus)
-        pheno_df_no_negative_vals["merged"] = pheno_df_no_negative_vals_consensus.values
+        merged_values = get_consensus_values(pheno_df_no_negative_vals.to_numpy(dtype=np.float64))
+        # the merged codes stay integers when all the field values are integers and every row reaches a consensus
+        all_integer = all(pd.api.types.is_integer_dtype(dtype) for dtype in pheno_df_no_negative_vals.dtypes)
+        if all_integer and len(merged_values) and not np.isnan(merged_values).any():
+            merged_values = merged_values.astype(np.int64)
+        pheno_df_no_negative_vals["merged"] = merged_values
         # drop rows that do not reach a consensus
         pheno_df_no_negative_vals = pheno_df_no_negative_vals.dropna(subset=["merged"])
     return pheno_df_no_negative_vals
 
-def merge_values_numerical(pheno_df_no_negative_vals):
+def get_consensus_values(values):
+    """
+    Computes the consensus of each row of a 2d float array of field values in one 
+    vectorized pass. It returns the first non null value of the row if all the non null 
+    values of the row are equal, else NaN
+    """
+    values_notnull = ~np.isnan(values)
+    values_first = values[np.arange(len(values)), values_notnull.argmax(axis=1)]
+    values_consistent = values_notnull.any(axis=1) & ((values == values_first[:, None]) | ~values_notnull).all(axis=1)
+    return np.where(values_consistent, values_first, np.nan)
+
+def merge_values_numerical(pheno_df_no_negative_vals, exclude_negatives=False):
     """
     Merges all the field values for UKBiobank into a single field value 
-    by taking the mean of all field values.
+    by taking the mean of all field values. With exclude_negatives, the negative
+    codes left in the kept samples are not counted in the mean.
     """
-    pheno_df_no_negative_vals["merged"] = pheno_df_no_negative_vals.mean(axis=1, numeric_only=True)
+    # the mean is always computed in float64 since the field values might be downcast
+    values = pheno_df_no_negative_vals.to_numpy(dtype=np.float64)
+    counted = values >= 0 if exclude_negatives else ~np.isnan(values)
+    pheno_df_no_negative_vals["merged"] = get_row_means(values, counted)
     return pheno_df_no_negative_vals
 
 
@@ -107,34 +328,133 @@ def merge_values_numerical(pheno_df_no_negative_vals):
 # binarizing values #
 #####################
 
-def binarize_numericals(df, strategy="median", quantile_low=0.25, quantile_high=0.75):
+def get_binarize_method(strategy):
+    """
+    Returns the method name of a binarizing strategy used in the binarized table names,
+    for e.g. quantile:0.25:0.75 is named quantile-0.25-0.75
+    """
+    return strategy.replace(":", "-")
 
-    ser = df["merged"]
 
-    if strategy == "median":
-        thresh = ser.median()
-        binarized_low = (ser<=thresh).astype(int)
-        binarized_high = (ser>thresh).astype(int)
-        df[f"binarized_{thresh}_low"] = binarized_low
-        df[f"binarized_{thresh}_high"] = binarized_high
+def parse_binarize_strategy(strategy, quantile_low=0.25, quantile_high=0.75):
+    """
+    Parses a binarizing strategy into its method name, kind and cut points. A strategy can be
+    1) median
+    2) quantile: uses the default low and high quantiles
+    3) quantile:<low>:<high>: uses the given low and high quantiles
+    4) threshold:<low>:<high>: uses the given values as the low and high thresholds
+    Any other strategy, for e.g. an empty one, does not binarize
+    """
+    strategy_kind, *strategy_cuts = strategy.split(":")
+    if strategy_kind == "quantile" and not strategy_cuts:
+        strategy_cuts = [quantile_low, quantile_high]
+    elif strategy_kind in {"quantile", "threshold"}:
+        if len(strategy_cuts) != 2:
+            raise ValueError(f"Binarizing strategy {strategy} should be {strategy_kind}:<low>:<high>")
+        strategy_cuts = [float(c) for c in strategy_cuts]
+    return get_binarize_method(strategy), strategy_kind, strategy_cuts
 
-    elif strategy == "quantile":
-        qlow = ser.quantile(quantile_low)
-        qhigh = ser.quantile(quantile_high)
 
-        binarized_low = (ser <= qlow).astype(int)
-        binarized_high = (ser >= qhigh).astype(int)
-        df[f"binarized_{qlow}_low"] = binarized_low
-        df[f"binarized_{qhigh}_high"] = binarized_high
+def get_sorted_quantiles(values_sorted, quantiles):
+    """
+    Returns the quantiles of the sorted values with linear interpolation between the two
+    nearest positions (n-1)*q, the same values as np.quantile without sorting again
+    """
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    if not len(values_sorted):
+        return np.full(quantiles.shape, np.nan)
+    positions = (len(values_sorted) - 1) * quantiles
+    positions_low = np.floor(positions)
+    positions_high = np.minimum(positions_low + 1, len(values_sorted) - 1)
+    gamma = positions - positions_low
+    values_low = values_sorted[positions_low.astype(np.int64)]
+    values_high = values_sorted[positions_high.astype(np.int64)]
+    # interpolates from the nearest of the two values, as numpy does
+    values_diff = values_high - values_low
+    return np.where(gamma >= 0.5, values_high - values_diff * (1 - gamma), values_low + values_diff * gamma)
+
+
+def get_sorted_median(values_sorted):
+    """
+    Returns the median of the sorted values, the mean of the two middle values for an even count
+    """
+    n = len(values_sorted)
+    if not n:
+        return np.nan
+    return np.mean(values_sorted[(n - 1) // 2:n // 2 + 1])
 
-    return df
 
+def binarize_numericals_multi(df, strategies, reference=None):
+    """
+    Binarizes the merged field values into low and high columns for each of the parsed
+    strategies. All the thresholds are computed from a single sorted copy of the reference 
+    merged values when given, else of the merged values. It returns a dict which maps the
+    method name of each strategy to its binarized table
+    """
+    ser = df["merged"]
+    ser_reference = ser if reference is None else reference
+    values_sorted = np.sort(ser_reference.dropna().to_numpy(dtype=np.float64))
+
+    binarized_dfs = {}
+    for method, strategy_kind, strategy_cuts in strategies:
+        binarized_cols = {}
+        if strategy_kind == "median":
+            thresh = get_sorted_median(values_sorted)
+            binarized_cols[f"binarized_{thresh}_low"] = (ser<=thresh).astype(int)
+            binarized_cols[f"binarized_{thresh}_high"] = (ser>thresh).astype(int)
+
+        elif strategy_kind in {"quantile", "threshold"}:
+            if strategy_kind == "quantile":
+                # same quantiles as pandas with linear interpolation
+                qlow, qhigh = get_sorted_quantiles(values_sorted, strategy_cuts)
+            else:
+                qlow, qhigh = strategy_cuts
+            binarized_cols[f"binarized_{qlow}_low"] = (ser <= qlow).astype(int)
+            binarized_cols[f"binarized_{qhigh}_high"] = (ser >= qhigh).astype(int)
+
+        binarized_dfs[method] = df.assign(**binarized_cols)
+    return binarized_dfs
+
+
+def binarize_numericals(df, strategy="median", quantile_low=0.25, quantile_high=0.75, reference=None):
+    """
+    Binarizes the merged field values into low and high columns. The thresholds are
+    computed from the reference merged values when given, else from the merged values
+    """
+    binarize_strategy = parse_binarize_strategy(strategy, quantile_low, quantile_high)
+    binarized_dfs = binarize_numericals_multi(df, [binarize_strategy], reference)
+    return binarized_dfs[binarize_strategy[0]]
 
-def get_ordinal_categorical_bins(df, field_encodings):
-    
+
+def get_field_value_positions(ser, fe_codes):
+    """
+    Returns the position of each value of the series among the sorted field value 
+    codes, and whether the value is one of the codes
+    """
+    values = ser.to_numpy(dtype=np.float64)
+    values_pos = np.minimum(np.searchsorted(fe_codes, values), len(fe_codes) - 1)
+    values_hit = fe_codes[values_pos] == values
+    return values_pos, values_hit
+
+
+def get_ordinal_categorical_bins(df, field_encodings, reference=None):
+    """
+    Binarizes the merged field values into low and high ordinal bins. The bins are 
+    selected from the reference merged values when given, else from the merged values
+    """
     ser = df["merged"]
+    ser_reference = ser if reference is None else reference
 
     field_encodings_relevant = sorted([int(fe) for fe in field_encodings.keys() if int(fe)>=0])
+    # count the samples of every relevant field value in a single pass,
+    # the bins are then selected from the cumulative counts
+    fe_codes = np.array(field_encodings_relevant, dtype=np.float64)
+    values_pos, values_hit = get_field_value_positions(ser_reference, fe_codes)
+    fe_counts = np.bincount(values_pos[values_hit], minlength=len(fe_codes))
+    fe_counts_low = np.cumsum(fe_counts)
+    fe_counts_high = np.cumsum(fe_counts[::-1])[::-1]
+    n_samples = len(ser_reference)
+
     # case 1, if there are two types of relevant categories for this field,
     # just return low and high
     if len(field_encodings_relevant) == 2:
@@ -146,39 +466,43 @@ def get_ordinal_categorical_bins(df, field_encodings):
         fe_high = field_encodings_relevant[-1]
         fe_high_val = field_encodings[str(fe_high)]
         fe_high_val = "-".join(fe_high_val.split())
-        # binarize
-        binarized_low = (ser == fe_low).astype(int)
-        binarized_high = (ser == fe_high).astype(int)
+        lower_bin_range, higher_bin_range = 1, 1
 
     # case 2, if there are more than two types of relevant categories for this field
     if len(field_encodings_relevant) > 2:
         # check how many low bins will give us at least 10% samples 
         # excluding the highest bin
         for lower_bin_range in range(1, len(field_encodings_relevant)):
-            fe_lows = field_encodings_relevant[:lower_bin_range]
-            fe_low_val = "|".join(["-".join(field_encodings[str(fe_low)].replace(",", "").split()) for fe_low in fe_lows])
-            binarized_low = ser.isin(fe_lows).astype(int)
-            if (sum(binarized_low)/len(binarized_low)) > 0.1:
+            if (fe_counts_low[lower_bin_range - 1]/n_samples) > 0.1:
                 break
         
         # check how many high bins will give us at least 10% samples 
         # excluding all the bins selected by the lower bin range
         for higher_bin_range in range(len(field_encodings_relevant) - 1, lower_bin_range - 1, -1):
-            fe_highs = field_encodings_relevant[higher_bin_range:]
-            fe_high_val = "|".join(["-".join(field_encodings[str(fe_high)].replace(",", "").split()) for fe_high in fe_highs])            
-            binarized_high = ser.isin(fe_highs).astype(int)
-            if (sum(binarized_high)/len(binarized_high)) > 0.1:
+            if (fe_counts_high[higher_bin_range]/n_samples) > 0.1:
                 break
+
+        fe_lows = field_encodings_relevant[:lower_bin_range]
+        fe_low_val = "|".join([hyphenate_encoding_label(field_encodings[str(fe_low)]) for fe_low in fe_lows])
+        fe_highs = field_encodings_relevant[higher_bin_range:]
+        fe_high_val = "|".join([hyphenate_encoding_label(field_encodings[str(fe_high)]) for fe_high in fe_highs])
+
+    # binarize
+    if reference is not None:
+        values_pos, values_hit = get_field_value_positions(ser, fe_codes)
+    binarized_low = pd.Series((values_hit & (values_pos < lower_bin_range)).astype(int), index=ser.index)
+    binarized_high = pd.Series((values_hit & (values_pos >= higher_bin_range)).astype(int), index=ser.index)
+    n_low, n_high = int(fe_counts_low[lower_bin_range - 1]), int(fe_counts_high[higher_bin_range])
     
     # check if the number of samples in the lowest and highest bins 
     # are less than 10% of the original number of samples
-    if (sum(binarized_low)/len(binarized_low)) < 0.1:
+    if (n_low/n_samples) < 0.1:
         print(f"Warning:: lowest category has less than 10% samples for field id {df.columns[0]}")
-        print(f"Warning:: lowest category has {sum(binarized_low)} samples")
+        print(f"Warning:: lowest category has {n_low} samples")
 
-    if (sum(binarized_high)/len(binarized_high)) < 0.1:
+    if (n_high/n_samples) < 0.1:
         print(f"Warning:: highest category has less than 10% samples for field id {df.columns[0]}")
-        print(f"Warning:: highest category has {sum(binarized_high)} samples w/ or w/o exomes")
+        print(f"Warning:: highest category has {n_high} samples w/ or w/o exomes")
 
     df[f"binarized_{fe_low_val}_low"] = binarized_low
     df[f"binarized_{fe_high_val}_high"] = binarized_high
@@ -193,16 +517,33 @@ def get_ohe_type_encoding(df, field_encodings):
     # add "None of the above", encoding value "-7", here if it is present
     if "-7" in field_encodings.keys():
         field_encodings_relevant.append(-7)
-    df_copy = df.copy()
-    for fe in field_encodings_relevant:
-        fe_ser = df.isin([fe]).any(axis=1).astype(int)
+    # map every value of the table to the position of its field encoding value 
+    # with a single search over the sorted codes, then scatter the matches into 
+    # the indicator matrix. As before, all columns of the table are looked up
+    fe_codes = np.array(field_encodings_relevant, dtype=np.float64)
+    fe_codes_order = np.argsort(fe_codes)
+    fe_codes_sorted = fe_codes[fe_codes_order]
+    fe_indicators = np.zeros((len(df), len(fe_codes)), dtype=np.uint8)
+    if len(fe_codes):
+        values = df.to_numpy(dtype=np.float64)
+        values_pos = np.minimum(np.searchsorted(fe_codes_sorted, values), len(fe_codes) - 1)
+        rows, cols = np.nonzero(fe_codes_sorted[values_pos] == values)
+        fe_indicators[rows, fe_codes_order[values_pos[rows, cols]]] = 1
+    
+    ohe_cols = {}
+    for fe_pos, fe in enumerate(field_encodings_relevant):
         fe_val = field_encodings[str(fe)]
-        fe_val = "-".join(fe_val.replace(",", "").split())
-        df_copy[f"binarized_{fe_val}"] = fe_ser    
-    return df_copy
+        fe_val = hyphenate_encoding_label(fe_val)
+        ohe_cols[f"binarized_{fe_val}"] = fe_indicators[:, fe_pos]
+    ohe_df = pd.DataFrame(ohe_cols, index=df.index)
+    return pd.concat([df.drop(columns=ohe_df.columns.intersection(df.columns)), ohe_df], axis=1)
 
 
-def binarize_categoricals(df, field_type, field_encodings, ordinal_status, ohe_encodings, ordinal_encodings):
+def binarize_categoricals(df, field_type, field_encodings, ordinal_status, ohe_encodings, ordinal_encodings, reference=None):
+    """
+    Binarizes categorical fields based on their type and ordinality. The reference 
+    merged values, when given, are used for selecting the ordinal bins
+    """
 
     if field_type == "categorical_single":
 
@@ -217,12 +558,12 @@ def binarize_categoricals(df, field_type, field_encodings, ordinal_status, ohe_e
                 print("Warning:: Still working on it!!")
                 print("Warning:: Encoding might be erroneous if ohe type field encodings have 1s!!")
                 # read new field encodings for high low 
-                df = get_ordinal_categorical_bins(df, ordinal_encodings)
+                df = get_ordinal_categorical_bins(df, ordinal_encodings, reference)
                 # read new field encodings for ohe type
                 df = get_ohe_type_encoding(df, ohe_encodings)
         
         else:
-            df = get_ordinal_categorical_bins(df, field_encodings)
+            df = get_ordinal_categorical_bins(df, field_encodings, reference)
 
     elif field_type == "categorical_multiple":
         if type(field_encodings) == dict:
@@ -238,8 +579,40 @@ def binarize_categoricals(df, field_type, field_encodings, ordinal_status, ohe_e
 # filtering for exomes #
 ########################
 
-def filter_pheno_with_exomes(binarized_df, exome_df):
-    binarized_df = binarized_df.loc[binarized_df.index.isin(exome_df.eid)]
+_SHARED_EXOME_EIDS = None
+
+def init_shared_exome_eids(exome_eids):
+    """
+    Pool initializer that stores the sorted exome sample ids once per worker
+    process, so they are not pickled along with every field task
+    """
+    global _SHARED_EXOME_EIDS
+    _SHARED_EXOME_EIDS = exome_eids
+    return
+
+def get_shared_exome_eids():
+    return _SHARED_EXOME_EIDS
+
+def is_exome_sample(eids, exome_eids):
+    """
+    Returns a boolean array marking which of the eids are present in the 
+    sorted exome sample id array using a binary search
+    """
+    eids = np.asarray(eids, dtype=np.int64)
+    if len(exome_eids) == 0:
+        return np.zeros(len(eids), dtype=bool)
+    pos = np.searchsorted(exome_eids, eids)
+    pos[pos == len(exome_eids)] = 0
+    return exome_eids[pos] == eids
+
+def filter_pheno_with_exomes(binarized_df, exome_eids=None):
+    """
+    Keeps pheno values only for the samples with exome data. The sorted exome 
+    sample ids default to the ones shared with this worker process
+    """
+    if exome_eids is None:
+        exome_eids = get_shared_exome_eids()
+    binarized_df = binarized_df.loc[is_exome_sample(binarized_df.index, exome_eids)]
     return binarized_df
 
 
@@ -247,17 +620,401 @@ def filter_pheno_with_exomes(binarized_df, exome_df):
 # saving binarized table #
 ##########################
 
+# binarized tables can be stored as the full csv table or as compact columnar files
+# that only keep the binarized indicator columns as uint8 along with the eid index
+STORAGE_FORMATS = {"csv": ".csv", "parquet": ".parquet", "npy": ".npy"}
+
+
+def get_binarized_columns(columns):
+    return [c for c in list(columns) if c.startswith("binarized_")]
+
+
+def get_npy_sidecar_path(table_path):
+    """
+    Returns the path of the npz sidecar file that stores the eid index and the
+    column names of a binarized table saved in the npy storage format
+    """
+    return f"{os.path.splitext(table_path)[0]}_index.npz"
+
+
 def save_pheno_table(
     binarized_pheno_df, storage_root_dir, 
     pheno_type, pheno_cat, pheno_id, 
-    method):
+    method, storage="csv"):
 
-    table_basename = f"{pheno_id}_{method}" if method else str(pheno_id)
-    binarized_pheno_path = os.path.join(
-        storage_root_dir, pheno_type, pheno_cat, "tables", f"{table_basename}.csv"
+    binarized_pheno_path = get_binarized_table_path(
+        storage_root_dir, pheno_type, pheno_cat, pheno_id, method, storage
         )
     os.makedirs(os.path.dirname(binarized_pheno_path), exist_ok=True)
-    binarized_pheno_df.to_csv(binarized_pheno_path)
+    if storage == "csv":
+        binarized_pheno_df.to_csv(binarized_pheno_path)
+        return
+    # the columnar formats only keep the binarized indicator columns
+    binarized_df = binarized_pheno_df.loc[:, get_binarized_columns(binarized_pheno_df.columns)].astype(np.uint8)
+    if storage == "parquet":
+        binarized_df.to_parquet(binarized_pheno_path)
+    elif storage == "npy":
+        np.save(binarized_pheno_path, binarized_df.to_numpy())
+        np.savez(
+            get_npy_sidecar_path(binarized_pheno_path), 
+            eids=binarized_df.index.to_numpy(dtype=np.int64), 
+            columns=np.array(binarized_df.columns, dtype=str)
+            )
+    else:
+        raise ValueError(f"Unknown storage format {storage}, expected one of {list(STORAGE_FORMATS)}")
+    return
+
+
+################
+# run manifest #
+################
+
+def hash_file(file_path, chunk_size=1<<24):
+    """
+    Returns the sha256 hex digest of the contents of a file read in chunks
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def hash_array(arr):
+    return hashlib.sha256(np.ascontiguousarray(arr).tobytes()).hexdigest()
+
+
+def hash_field_inputs(**field_inputs):
+    """
+    Returns the sha256 hex digest of all the inputs that determine a binarized table 
+    such as the raw table hash, field encodings, ordinality and binarizing strategy
+    """
+    field_inputs_str = json.dumps(field_inputs, sort_keys=True, default=str)
+    return hashlib.sha256(field_inputs_str.encode()).hexdigest()
+
+
+def get_run_manifest_path(storage_root_dir, pheno_type, shard=None):
+    # one manifest per field type keyed by binarized table path, so that runs with any strategies share it;
+    # every shard of a sharded run keeps its own manifest so that concurrent shards never overwrite each other
+    return os.path.join(storage_root_dir, "manifests", f"binarize_{pheno_type}{get_shard_suffix(shard)}.json")
+
+
+def get_manifest_key(storage_root_dir, binarized_table_path):
+    return os.path.relpath(binarized_table_path, storage_root_dir)
+
+
+def read_run_manifest(manifest_path):
+    """
+    Reads the binarized table path to manifest entry mapping of the last run, 
+    returns an empty mapping if there was no previous run
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    return manifest
+
+
+def get_run_manifest_entry(manifest_value):
+    """
+    Returns a run manifest entry as a dict of the input hash of the binarized table and the hash and
+    [size, mtime] of its raw table. The entries of manifests written before the raw table stats were
+    recorded are the bare input hash, which stays valid
+    """
+    if manifest_value is None:
+        return {}
+    return {"hash": manifest_value} if isinstance(manifest_value, str) else manifest_value
+
+
+def write_run_manifest(manifest_path, manifest):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    write_json_atomic(manifest_path, manifest, indent=4, sort_keys=True)
+    return
+
+
+##########################
+# scheduling field tasks #
+##########################
+
+def get_n_threads(n_threads=None):
+    """
+    Returns the number of worker processes, which is the user provided number if any,
+    else the number of cpus allocated by SLURM, else the number of cpus of the node
+    """
+    if n_threads:
+        return n_threads
+    slurm_cpus = os.environ.get("SLURM_CPUS_PER_TASK")
+    if slurm_cpus:
+        return int(slurm_cpus)
+    return os.cpu_count()
+
+
+def estimate_table_cost(table_path):
+    """
+    Estimates the cost of processing a table as its file size times its number of columns,
+    tables that do not exist cost nothing so that their tasks fail fast
+    """
+    if not os.path.exists(table_path):
+        return 0
+    table_ext = os.path.splitext(table_path)[1]
+    if table_ext == ".parquet":
+        # the column count is in the parquet footer, the file size alone is used without pyarrow
+        try:
+            import pyarrow.parquet as pq
+            n_cols = pq.read_metadata(table_path).num_columns
+        except ImportError:
+            n_cols = 1
+    elif table_ext == ".npy":
+        # only the npy header is read for the shape
+        n_cols = np.load(table_path, mmap_mode="r").shape[-1]
+    else:
+        with open(table_path, "r") as f:
+            n_cols = f.readline().count(",") + 1
+    return os.path.getsize(table_path) * n_cols
+
+
+def run_isolated_task(task):
+    """
+    Runs a single task of the pool, any exception is caught and returned with its traceback 
+    so that one failing field does not bring down the whole pool
+    """
+    func, position, args = task
+    try:
+        return position, func(*args), None
+    except Exception:
+        return position, None, traceback.format_exc()
+
+
+def imap_tasks_by_cost(func, pool_iter, costs, n_workers, initializer=None, initargs=()):
+    """
+    Runs the tasks in a pool of worker processes in decreasing order of their estimated cost
+    and yields (position, result, error) of each task in the order they complete. At most one
+    task per worker is in flight, so when a worker dies, for e.g. killed out of memory, the tasks
+    in flight are known: they are run again one at a time in a new pool, a task that kills its
+    worker while it runs alone fails, and the rest of the tasks are resumed
+    """
+    pending = deque(sorted(range(len(pool_iter)), key=lambda position: costs[position], reverse=True))
+    suspects = deque()
+    while pending or suspects:
+        with ProcessPoolExecutor(n_workers, initializer=initializer, initargs=initargs) as executor:
+            in_flight = {}
+            while pending or suspects or in_flight:
+                # the tasks in flight when a worker died run alone, the others fill every worker
+                while (suspects and not in_flight) or (not suspects and pending and len(in_flight) < n_workers):
+                    position = (suspects or pending).popleft()
+                    in_flight[executor.submit(run_isolated_task, (func, position, pool_iter[position]))] = position
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                lost = []
+                for future in done:
+                    position = in_flight.pop(future)
+                    try:
+                        yield future.result()
+                    except BrokenProcessPool:
+                        lost.append(position)
+                    except Exception:
+                        # for e.g. a result that could not be sent back from the worker
+                        yield position, None, traceback.format_exc()
+                if lost:
+                    # a broken pool fails all the tasks in flight, not only the one of the dead worker
+                    lost.extend(in_flight.values())
+                    if len(lost) == 1:
+                        yield lost[0], None, "The worker process died while running the task alone, for e.g. killed out of memory"
+                    else:
+                        suspects.extend(sorted(lost, key=lambda position: costs[position], reverse=True))
+                    break
+    return
+
+
+def assign_tasks_by_cost(costs, n_bins):
+    """
+    Splits the task positions into bins of about equal total cost by assigning the
+    tasks in decreasing order of cost to the bin with the lowest total cost so far.
+    The assignment is deterministic and the tasks of every bin are kept in decreasing 
+    order of cost, some bins might be empty
+    """
+    bins = [[] for _ in range(n_bins)]
+    bin_heap = [(0, bin_idx) for bin_idx in range(n_bins)]
+    for position in sorted(range(len(costs)), key=lambda position: costs[position], reverse=True):
+        bin_cost, bin_idx = heapq.heappop(bin_heap)
+        bins[bin_idx].append(position)
+        heapq.heappush(bin_heap, (bin_cost + costs[position], bin_idx))
+    return bins
+
+
+def get_cost_balanced_batches(costs, n_batches):
+    return [batch for batch in assign_tasks_by_cost(costs, n_batches) if batch]
+
+
+def parse_shard(shard):
+    """
+    Parses a shard given as i/N, where i is the 1-based index of the shard among N shards
+    """
+    shard_idx, n_shards = (int(x) for x in shard.split("/"))
+    if not 1 <= shard_idx <= n_shards:
+        raise ValueError(f"Shard {shard} should be i/N with 1 <= i <= N")
+    return shard_idx, n_shards
+
+
+def get_shard_positions(costs, shard):
+    """
+    Returns the sorted task positions of a shard. Tasks are split among the shards by
+    balanced cost, so every shard of a run gets the same assignment given the same costs
+    """
+    shard_idx, n_shards = shard
+    return sorted(assign_tasks_by_cost(costs, n_shards)[shard_idx - 1])
+
+
+def get_shard_suffix(shard):
+    return f".shard{shard[0]}of{shard[1]}" if shard else ""
+
+
+##############
+# run report #
+##############
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory of the current process to its current resident memory,
+    returns False where the kernel does not allow it
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident memory of the current process in MB since it was last reset
+    """
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return np.nan
+
+
+def get_lifetime_peak_rss_mb():
+    # the peak resident memory of the current process since it started, which is never reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# the enabled reports of the fields in flight in this process, with prefetching several fields
+# are in flight at once; the peak memory is only reset when no other field is in flight, so that
+# the peak of a field is the peak while it was in flight and never misses any of its memory
+_REPORTS_IN_FLIGHT = weakref.WeakSet()
+_REPORTS_IN_FLIGHT_LOCK = threading.Lock()
+
+
+class FieldReport:
+    """
+    Opt-in instrumentation of a field: the wall time of every stage, the number of rows
+    after every stage and the prevalence of every output indicator column. 
+    A disabled report records nothing
+    """
+    def __init__(self, pheno_id, pheno_type, enabled=True):
+        self.enabled = enabled
+        self.pheno_id = pheno_id
+        self.pheno_type = pheno_type
+        self.stage_times = {}
+        self.rows = {}
+        self.prevalences = {}
+        self.skipped = False
+        self.last_lap = time.perf_counter()
+        if self.enabled:
+            self.start_memory()
+
+    def start_memory(self):
+        """
+        Resets the peak memory of the process unless another field is in flight. Where it
+        cannot be reset, the increase of the lifetime peak memory over the field is recorded
+        """
+        with _REPORTS_IN_FLIGHT_LOCK:
+            reports_in_flight = list(_REPORTS_IN_FLIGHT)
+            self.peak_rss_reset = reports_in_flight[0].peak_rss_reset if reports_in_flight else reset_peak_rss()
+            self.start_lifetime_peak_rss_mb = get_lifetime_peak_rss_mb()
+            _REPORTS_IN_FLIGHT.add(self)
+        return
+
+    def get_memory(self):
+        with _REPORTS_IN_FLIGHT_LOCK:
+            _REPORTS_IN_FLIGHT.discard(self)
+            if self.peak_rss_reset:
+                return {"peak_rss_mb": get_peak_rss_mb()}
+            return {"peak_rss_increase_mb": get_lifetime_peak_rss_mb() - self.start_lifetime_peak_rss_mb}
+
+    def lap(self, stage, df=None):
+        """
+        Records the time since the previous lap as the wall time of the stage, 
+        and the rows of the stage's output table when given
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.stage_times[stage] = self.stage_times.get(stage, 0) + now - self.last_lap
+        self.last_lap = now
+        if df is not None:
+            self.rows[stage] = len(df)
+        return
+
+    def count_indicators(self, df, columns, name=""):
+        """
+        Records the fraction of samples with a value that are 1 in every indicator column
+        """
+        if not self.enabled:
+            return
+        prevalences = df.loc[:, columns].mean().to_dict()
+        self.prevalences.update({f"{name}:{col}" if name else col: float(prev) for col, prev in prevalences.items()})
+        return
+
+    def to_dict(self):
+        if not self.enabled:
+            return None
+        return {
+            "pheno_id": self.pheno_id,
+            "pheno_type": self.pheno_type,
+            "skipped": self.skipped,
+            "total_time": sum(self.stage_times.values()),
+            **self.get_memory(),
+            "stage_times": self.stage_times,
+            "rows": self.rows,
+            "n_output_columns": len(self.prevalences),
+            "prevalences": self.prevalences,
+            }
+
+
+def get_run_report_path(storage_root_dir, report_name, ext):
+    return os.path.join(storage_root_dir, "reports", f"{report_name}{ext}")
+
+
+def write_run_report(storage_root_dir, report_name, field_reports, top_n=10):
+    """
+    Writes the field reports of a run as a json report along with the top n slowest fields,
+    and as a csv table with one row per field without the indicator prevalences
+    """
+    if not field_reports:
+        print("Warning:: no field was reported, the run report is not saved")
+        return
+    report_df = pd.json_normalize(field_reports)
+    report_df = report_df.drop(columns=[c for c in report_df.columns if c.split(".")[0] == "prevalences"])
+    slowest_df = report_df.sort_values("total_time", ascending=False).head(top_n)
+    slowest_cols = ["pheno_id", "pheno_type", "total_time", "peak_rss_mb", "peak_rss_increase_mb", "n_output_columns"]
+    slowest_df = slowest_df.loc[:, [c for c in slowest_cols if c in slowest_df.columns]]
+    run_report = {
+        "n_fields": len(field_reports),
+        "total_time": float(report_df.total_time.sum()),
+        "slowest_fields": slowest_df.to_dict(orient="records"),
+        "fields": field_reports,
+        }
+    report_path = get_run_report_path(storage_root_dir, report_name, ".json")
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(run_report, f, indent=1, default=str)
+    report_df.to_csv(get_run_report_path(storage_root_dir, report_name, ".csv"), index=False)
+    print(f"Run report saved to {report_path}, the {top_n} slowest fields are")
+    print(slowest_df.to_string(index=False))
     return
 
 
@@ -265,7 +1022,7 @@ def save_pheno_table(
 # field encodings parser #
 ##########################
 
-def get_pheno_encoding_filepath(root_dir, pheno_type, pheno_cat):
+def get_pheno_encoding_filepath(root_dir, pheno_type, pheno_cat, check_exists=True):
     """
     This function accepts
     1) root_dir: where the sample to phenotype value table is stored under type -> category -> id hierarchy
@@ -278,11 +1035,12 @@ def get_pheno_encoding_filepath(root_dir, pheno_type, pheno_cat):
     pheno_json_path = os.path.join(
         root_dir, pheno_type, pheno_cat, f"fields_data_coding.json"
         )
-    assert os.path.exists(pheno_json_path)
+    if check_exists:
+        assert os.path.exists(pheno_json_path)
     return pheno_json_path
 
 
-def get_modified_pheno_encoding_filepath(root_dir, enc_type):
+def get_modified_pheno_encoding_filepath(root_dir, enc_type, check_exists=True):
     """
     This function accepts
     1) root_dir: where the sample to phenotype value table is stored under type -> category -> id hierarchy
@@ -295,17 +1053,148 @@ def get_modified_pheno_encoding_filepath(root_dir, enc_type):
     pheno_json_path = os.path.join(
         root_dir, "modified_field_encodings", enc_type, f"field_encodings.json"
         )
-    assert os.path.exists(pheno_json_path)
+    if check_exists:
+        assert os.path.exists(pheno_json_path)
     return pheno_json_path
 
 
-def read_pheno_encodings(pheno_json_path, pheno_field_id):
-    pheno_field_id = str(pheno_field_id)
+@functools.lru_cache(maxsize=None)
+def load_pheno_encodings(pheno_json_path):
+    """
+    Loads a field encodings json file only once per process, since all the fields
+    of a category share the same file. The returned dict is shared and must not be modified
+    """
     with open(pheno_json_path, "r") as f:
         field_encoding_dict = json.load(f)
+    return {str(k):v for k,v in field_encoding_dict.items()}
+
+
+def read_pheno_encodings(pheno_json_path, pheno_field_id):
+    pheno_field_id = str(pheno_field_id)
+    field_encoding_dict = load_pheno_encodings(os.path.abspath(pheno_json_path))
     return field_encoding_dict[pheno_field_id]
 
 
+@functools.lru_cache(maxsize=None)
+def hyphenate_encoding_label(label):
+    return "-".join(label.replace(",", "").split())
+
+
+@functools.lru_cache(maxsize=None)
+def read_inverted_pheno_encodings(pheno_json_path, pheno_field_id):
+    """
+    Returns the hyphenated field value label to field value code mapping of a field,
+    computed once per process. The returned dict is shared and must not be modified
+    """
+    return invert_pheno_encodings(read_pheno_encodings(pheno_json_path, pheno_field_id))
+
+
+def invert_pheno_encodings(pheno_encodings):
+    if type(pheno_encodings) == dict:
+        pheno_encodings = {hyphenate_encoding_label(v):k for k,v in pheno_encodings.items()}
+    return pheno_encodings
+
+
+#######################
+# compiled field plan #
+#######################
+
+# the field plan is the phenos of interest file compiled once into a json file with, for every field,
+# its raw table path and estimated cost, its encodings and the paths of its binarized tables, so that
+# both stages start without parsing the excel file and their workers without reading the encodings
+
+def get_field_plan_path(storage_root_dir, name="field_plan"):
+    return os.path.join(storage_root_dir, "plans", f"{name}.json")
+
+
+def is_field_plan(file):
+    return os.path.splitext(file)[1] == ".json"
+
+
+def get_source_stat(file):
+    file_stat = os.stat(file)
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+
+def compile_field_plan(phenos_of_interest_file, pheno_info_root, pheno_storage_root, strategies, storage="csv"):
+    """
+    Compiles the fields of the phenos of interest file into the field plan. The binarized table 
+    paths of integer and continuous fields are resolved for every strategy and the ones of the
+    categorical fields for the unnamed strategy. The stat of every file read is recorded, so 
+    that a plan whose sources changed is never used
+    """
+    phenos_of_interest_df = read_phenos_of_interest_data(phenos_of_interest_file)
+    numerical_methods = [get_binarize_method(strategy) for strategy in strategies]
+    sources = {os.path.abspath(phenos_of_interest_file): get_source_stat(phenos_of_interest_file)}
+    def read_source_encodings(pheno_json_path, pheno_id):
+        # fields whose encodings can not be read are planned without them and fail when they are processed
+        try:
+            pheno_encodings = read_pheno_encodings(pheno_json_path, pheno_id)
+        except (OSError, KeyError, ValueError):
+            return None
+        sources[os.path.abspath(pheno_json_path)] = get_source_stat(pheno_json_path)
+        return pheno_encodings
+
+    plan_fields = []
+    for t, c, i, o in zip(
+        phenos_of_interest_df.Type, phenos_of_interest_df.Phenotype_group, 
+        phenos_of_interest_df.Phenotype_ID, phenos_of_interest_df.not_ordinal):
+        pheno_table_path = get_pheno_table_filepath(pheno_info_root, t, c, i, check_exists=False)
+        # the field, ohe and ordinal encodings of a categorical field, the latter two only for fields with both kinds of codes
+        pheno_encodings = None
+        if t in {"categorical_single", "categorical_multiple"}:
+            pheno_encodings = [read_source_encodings(get_pheno_encoding_filepath(pheno_info_root, t, c, check_exists=False), i), None, None]
+            if o == "B":
+                pheno_encodings[1] = read_source_encodings(get_modified_pheno_encoding_filepath(pheno_storage_root, "ohe", check_exists=False), i)
+                pheno_encodings[2] = read_source_encodings(get_modified_pheno_encoding_filepath(pheno_storage_root, "ordinal", check_exists=False), i)
+            if None in pheno_encodings[:3 if o == "B" else 1]:
+                pheno_encodings = None
+        methods = numerical_methods if t in {"integer", "continuous"} else [""]
+        plan_fields.append({
+            "pheno_type": t, "pheno_cat": c, "pheno_id": int(i), "pheno_ordinal": None if pd.isnull(o) else o,
+            "pheno_table_path": pheno_table_path, "cost": estimate_table_cost(pheno_table_path),
+            "encodings": pheno_encodings,
+            "binarized_tables": {method: get_binarized_table_path(pheno_storage_root, t, c, i, method, storage) for method in methods},
+            })
+    return {
+        "pheno_info_root": os.path.abspath(pheno_info_root), "pheno_storage_root": os.path.abspath(pheno_storage_root),
+        "strategies": list(strategies), "storage": storage, "sources": sources, "fields": plan_fields,
+        }
+
+
+def write_field_plan(plan_path, field_plan):
+    os.makedirs(os.path.dirname(os.path.abspath(plan_path)), exist_ok=True)
+    write_json_atomic(plan_path, field_plan, indent=1)
+    return
+
+
+def read_field_plan(plan_path, pheno_info_root, pheno_storage_root, storage):
+    """
+    Reads a field plan after checking that it was compiled for the same roots and storage 
+    format and that none of its sources changed since, else raises a ValueError
+    """
+    with open(plan_path, "r") as f:
+        field_plan = json.load(f)
+    plan_args = (field_plan["pheno_info_root"], field_plan["pheno_storage_root"], field_plan["storage"])
+    if plan_args != (os.path.abspath(pheno_info_root), os.path.abspath(pheno_storage_root), storage):
+        raise ValueError(f"The field plan {plan_path} was compiled for the roots and storage {plan_args}")
+    for source, source_stat in field_plan["sources"].items():
+        if not os.path.exists(source) or get_source_stat(source) != source_stat:
+            raise ValueError(f"{source} changed since the field plan {plan_path} was compiled, compile it again")
+    return field_plan
+
+
+def get_plan_fields(field_plan, pheno_type=None):
+    """
+    Returns the (type, category, id, ordinality, plan) of the fields of the plan, with the
+    ordinality of fields without one as NaN like in the phenos of interest file
+    """
+    return [
+        (f["pheno_type"], f["pheno_cat"], f["pheno_id"], np.nan if f["pheno_ordinal"] is None else f["pheno_ordinal"], f)
+        for f in field_plan["fields"] if pheno_type is None or f["pheno_type"] == pheno_type
+        ]
+
+
 #########################
 # meta table formatting #
 #########################
@@ -314,8 +1203,9 @@ def get_exome_index(exome_file):
     return pd.read_csv(exome_file, index_col=0).dropna(how="all").index
 
 
-def get_binarized_table_path(root_dir, pheno_type, pheno_cat, pheno_id, strategy):
-    pheno_basename = f"{pheno_id}_{strategy}.csv" if strategy else f"{pheno_id}.csv"
+def get_binarized_table_path(root_dir, pheno_type, pheno_cat, pheno_id, strategy, storage="csv"):
+    pheno_ext = STORAGE_FORMATS[storage]
+    pheno_basename = f"{pheno_id}_{strategy}{pheno_ext}" if strategy else f"{pheno_id}{pheno_ext}"
     pheno_binarized_table_path = os.path.join(
         root_dir, 
         pheno_type, 
@@ -326,9 +1216,35 @@ def get_binarized_table_path(root_dir, pheno_type, pheno_cat, pheno_id, strategy
     return pheno_binarized_table_path
 
 
-def read_binarized_table(table_path):
-    df = pd.read_csv(table_path, index_col=0)
-    df_columns = [c for c in list(df.columns) if c.startswith("binarized_")]
+def read_binarized_table(table_path, columns=None):
+    """
+    Reads only the binarized columns of a binarized table stored in any of the 
+    storage formats. The columns argument can be used to further project the table
+    """
+    table_ext = os.path.splitext(table_path)[1]
+    if table_ext == ".parquet":
+        df = pd.read_parquet(table_path, columns=columns)
+    elif table_ext == ".npy":
+        # the sidecar is closed right after its arrays are read
+        with np.load(get_npy_sidecar_path(table_path)) as sidecar:
+            table_eids = sidecar["eids"]
+            table_columns = list(sidecar["columns"])
+        values = np.load(table_path, mmap_mode="r")
+        if columns is not None:
+            values = values[:, [table_columns.index(c) for c in columns]]
+            table_columns = list(columns)
+        df = pd.DataFrame(
+            np.asarray(values), 
+            index=pd.Index(table_eids, name="eid"), 
+            columns=table_columns
+            )
+    else:
+        # parse only the index and the binarized columns of the full csv table
+        header = list(pd.read_csv(table_path, nrows=0).columns)
+        usecols = columns if columns is not None else get_binarized_columns(header[1:])
+        df = pd.read_csv(table_path, index_col=header[0], usecols=[header[0]] + list(usecols))
+        df = df.loc[:, list(usecols)]
+    df_columns = get_binarized_columns(df.columns)
     # checking to see that there are at least 2 binarized columns
     if len(df_columns)<2:
         print(f"Warning:: {table_path} was not binarized")
@@ -351,10 +1267,7 @@ def reindex_binarized_table1(pheno_df, pheno_id, exome_index):
 
 def get_field_encodings(root_dir, pheno_type, pheno_cat, pheno_id):
     pheno_json_path = get_pheno_encoding_filepath(root_dir, pheno_type, pheno_cat)
-    pheno_encodings = read_pheno_encodings(pheno_json_path, pheno_id)
-    if type(pheno_encodings) == dict:
-        pheno_encodings = {"-".join(v.replace(",", "").split()):k for k,v in pheno_encodings.items()}
-    return pheno_encodings
+    return read_inverted_pheno_encodings(os.path.abspath(pheno_json_path), str(pheno_id))
 
 
 def reindex_binarized_table2(pheno_df, pheno_id, pheno_encodings, exome_index):
@@ -372,10 +1285,7 @@ def reindex_binarized_table2(pheno_df, pheno_id, pheno_encodings, exome_index):
 
 def get_modified_field_encodings(root_dir, enc_type, pheno_id):
     pheno_json_path = get_modified_pheno_encoding_filepath(root_dir, enc_type)
-    pheno_encodings = read_pheno_encodings(pheno_json_path, pheno_id)
-    if type(pheno_encodings) == dict:
-        pheno_encodings = {"-".join(v.replace(",", "").split()):k for k,v in pheno_encodings.items()}
-    return pheno_encodings
+    return read_inverted_pheno_encodings(os.path.abspath(pheno_json_path), str(pheno_id))
 
 
 def reindex_binarized_table3(pheno_df, pheno_id, ohe_encodings, exome_index):